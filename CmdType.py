@@ -1,25 +1,77 @@
+import os
+import threading
 import jinja2
 import yaml
 import re
+from base64 import b64decode
+from limits import ResourceLimits
 
 
-def make_cmd(args: dict, template: list[str], task_type: str) -> tuple[bool, str | None, list[str] | None]:
+class TaskType:
+    """
+    Task type description from commands.yaml with precompiled regexes and templates
+    """
+
+    def __init__(self, name: str, info: dict):
+        self.name = name
+        self.info = info
+        self.possible_args = {k: re.compile(v) for k, v in info["possible_args"].items()}
+        self.possible_env = {k: re.compile(v) for k, v in info["possible_env"].items()}
+        self.template = [jinja2.Template(element) for element in info["template"]]
+        # NOTE: files are decoded once, not for each job
+        self.files = {k: b64decode(v) if isinstance(v, str) else v for k, v in info["files"].items()}
+        # NOTE: limits are validated on load, so wrong limits are found before any job is started
+        self.limits = ResourceLimits.from_config(info.get("limits"))
+
+
+class CommandCatalogue:
+    """
+    Loads commands file once and reloads it only when file's mtime is changed
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._mtime = None
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def _reload(self) -> None:
+        mtime = os.stat(self._path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            with open(self._path, "r") as file:
+                info = yaml.safe_load(file)
+            self._tasks = {k: TaskType(k, v) for k, v in (info or {}).items()}
+            self._mtime = mtime
+
+    def get(self, task_type: str) -> TaskType | None:
+        self._reload()
+        return self._tasks.get(task_type)
+
+
+catalogue = CommandCatalogue("files_yaml/commands.yaml")
+
+
+def make_cmd(args: dict, template: list, task_type: str) -> tuple[bool, str | None, list[str] | None]:
     cmd = [task_type]
     for element in template:
-        tmp = jinja2.Template(element)
+        tmp = element if isinstance(element, jinja2.Template) else jinja2.Template(element)
         text = tmp.render(args=args)
         cmd.append(text)
     return True, None, cmd
 
 
 def get_params(task_type: str, task_args: dict, task_env: dict) -> tuple[bool, str | None, dict | None]:
-    with open("files_yaml/commands.yaml", "r") as file:
-        info = yaml.safe_load(file)
+    task = catalogue.get(task_type)
 
-    if task_type in info:
+    if task is not None:
+        info = task.info
         for key in task_args:
-            if key in info[task_type]["possible_args"]:
-                if not re.match(info[task_type]["possible_args"][key], str(task_args[key])):
+            if key in task.possible_args:
+                if not task.possible_args[key].match(str(task_args[key])):
                     err_msg = "Неправильно заданы параметры cmd"
                     return False, err_msg, None
             else:
@@ -27,30 +79,38 @@ def get_params(task_type: str, task_args: dict, task_env: dict) -> tuple[bool, s
                 return False, err_msg, None
 
         for key in task_env:
-            if key in info[task_type]["possible_env"]:
-                if not re.match(info[task_type]["possible_env"][key], task_env[key]):
+            if key in task.possible_env:
+                if not task.possible_env[key].match(task_env[key]):
                     err_msg = "Неправильно заданы параметры env"
                     return False, err_msg, None
             else:
                 err_msg = "Такого аргумента для env нет"
                 return False, err_msg, None
 
-        final_args = {**info[task_type]["args"], **task_args}
-        final_env = {**info[task_type]["env"], **task_env}
+        final_args = {**info["args"], **task_args}
+        final_env = {**info["env"], **task_env}
 
-        success, err_msg, result = make_cmd(final_args, info[task_type]["template"], task_type)
+        success, err_msg, result = make_cmd(final_args, task.template, task_type)
 
         if success:
             params = {
-                "max_runtime": info[task_type]["max_runtime"],
-                "terminate_timeout": info[task_type]["terminate_timeout"],
-                "encoding": info[task_type]["encoding"],
+                "max_runtime": info["max_runtime"],
+                "terminate_timeout": info["terminate_timeout"],
+                "encoding": info["encoding"],
                 "cmd": result,
-                "shell": info[task_type]["shell"],
+                "shell": info["shell"],
                 "env": final_env,
-                "files": info[task_type]["files"],
-                "artifacts": info[task_type]["artifacts"],
-                "logs": info[task_type]["logs"],
+                "files": dict(task.files),
+                "artifacts": list(info["artifacts"]),
+                "logs": list(info["logs"]),
+                "log_lines": info.get("log_lines"),
+                "capture": info.get("capture"),
+                "warm": info.get("warm"),
+                "warm_preload": info.get("warm_preload"),
+                "sample_interval": info.get("sample_interval"),
+                "limits": task.limits.to_dict() if task.limits else None,
+                "seed": info.get("seed"),
+                "workspace": info.get("workspace", "disk"),
             }
             return True, None, params
         else:
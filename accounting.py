@@ -0,0 +1,175 @@
+import os
+import asyncio
+import threading
+import warnings
+
+
+# NOTE: resource usage of jobs. Final usage of process is taken from wait4 rusage (exact, includes
+# children that process waited for): regular subprocesses are reaped by RusageChildWatcher,
+# warm processes - by zygote, which reports rusage with exit status.
+# While process is running it's usage can be sampled from /proc (see UsageSeries).
+# NOTE: rusage's max RSS of exec'ed process includes RSS of process it's forked from (server itself),
+# so it's reported only as an upper bound (max_rss_bound). max_rss is job's own peak: from job's cgroup
+# (see limits, exact for whole process tree) or from samples (misses peaks after last sample), None otherwise
+
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def from_rusage(ru) -> dict:
+    """
+    Usage of process from wait4/getrusage result
+    """
+    return {
+        "user_time": ru.ru_utime,
+        "sys_time": ru.ru_stime,
+        # NOTE: ru_maxrss is in KiB on Linux
+        "max_rss_bound": ru.ru_maxrss * 1024,
+        "read_bytes": ru.ru_inblock * 512,
+        "write_bytes": ru.ru_oublock * 512,
+    }
+
+
+def read_proc(pid: int) -> dict | None:
+    """
+    Current usage of running process from /proc (None if it's not available)
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # NOTE: process name may contain spaces and brackets, fields are after the last ')'
+    fields = stat[stat.rfind(b")") + 2:].split()
+    result = {
+        "user_time": (int(fields[11]) + int(fields[13])) / _CLK_TCK,
+        "sys_time": (int(fields[12]) + int(fields[14])) / _CLK_TCK,
+        "rss": None,
+        "max_rss": None,
+        "read_bytes": None,
+        "write_bytes": None,
+    }
+    try:
+        with open(f"/proc/{pid}/status", "rb") as f:
+            for line in f:
+                key, _, value = line.partition(b":")
+                if key == b"VmRSS":
+                    result["rss"] = int(value.split()[0]) * 1024
+                elif key == b"VmHWM":
+                    result["max_rss"] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    try:
+        with open(f"/proc/{pid}/io", "rb") as f:
+            for line in f:
+                key, _, value = line.partition(b":")
+                if key == b"read_bytes":
+                    result["read_bytes"] = int(value)
+                elif key == b"write_bytes":
+                    result["write_bytes"] = int(value)
+    except OSError:
+        pass
+    return result
+
+
+class UsageSeries:
+    """
+    Compact time series of process samples: [time, cpu time, rss].
+    When it's full every other sample is dropped and sampling interval is doubled,
+    so series always covers whole run with at most max_points samples
+    """
+
+    def __init__(self, interval: float, max_points: int = 512):
+        self.interval = interval
+        self._max_points = max(max_points, 2)
+        self._skip = 1
+        self._count = 0
+        self.points = []
+        self.last = None
+        self.peak_rss = None
+
+    def add(self, timestamp: float, sample: dict) -> None:
+        self.last = sample
+        if sample["max_rss"] is not None:
+            self.peak_rss = max(self.peak_rss or 0, sample["max_rss"])
+        self._count += 1
+        if self._count % self._skip:
+            return
+        self.points.append([timestamp, round(sample["user_time"] + sample["sys_time"], 3), sample["rss"]])
+        if len(self.points) >= self._max_points:
+            self.points = self.points[::2]
+            self._skip *= 2
+
+    def to_dict(self) -> dict:
+        return {"interval": self.interval * self._skip, "points": list(self.points)}
+
+
+# NOTE: child watchers are for unix only
+class RusageChildWatcher(getattr(asyncio, "AbstractChildWatcher", object)):
+    """
+    Child watcher, that reaps processes with wait4 (a thread per process as default ThreadedChildWatcher)
+    and keeps their rusage until it's taken with pop_usage
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usage = {}
+
+    def is_active(self):
+        return True
+
+    def close(self):
+        pass
+
+    def attach_loop(self, loop):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def add_child_handler(self, pid, callback, *args):
+        loop = asyncio.get_running_loop()
+        threading.Thread(target=self._wait, args=(loop, pid, callback, args), name=f"wait4-{pid}",
+                         daemon=True).start()
+
+    def remove_child_handler(self, pid):
+        # NOTE: process is reaped by it's thread anyway
+        return True
+
+    def _wait(self, loop, pid: int, callback, args) -> None:
+        try:
+            _, status, ru = os.wait4(pid, 0)
+            returncode = os.waitstatus_to_exitcode(status)
+            with self._lock:
+                self._usage[pid] = from_rusage(ru)
+        except ChildProcessError:
+            # NOTE: process is reaped by someone else, exit status is unknown
+            returncode = 255
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(callback, pid, returncode, *args)
+
+    def pop_usage(self, pid: int) -> dict | None:
+        with self._lock:
+            return self._usage.pop(pid, None)
+
+
+child_watcher = None
+
+
+def install_child_watcher() -> RusageChildWatcher | None:
+    """
+    Make asyncio reap subprocesses with RusageChildWatcher (once per process).
+    Returns None where child watchers are not supported, then usage of subprocesses is sampled only
+    """
+    global child_watcher
+    if child_watcher is None and os.name == "posix" and hasattr(asyncio, "set_child_watcher") \
+            and hasattr(os, "wait4"):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            watcher = RusageChildWatcher()
+            asyncio.set_child_watcher(watcher)
+        child_watcher = watcher
+    return child_watcher
@@ -0,0 +1,209 @@
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+
+class QueuedJob:
+    """
+    Job waiting for a slot: start is called when slot is reserved for it,
+    drop is called with reason if it's removed from queue without start
+    """
+
+    __slots__ = ("token", "type_request", "client", "enqueued", "deadline", "start", "drop", "future")
+
+    def __init__(self, token: int, type_request: bool, client: str, max_wait: float, start, drop):
+        self.token = token
+        self.type_request = type_request
+        self.client = client
+        self.enqueued = time.time()
+        self.deadline = self.enqueued + max_wait
+        self.start = start
+        self.drop = drop
+        self.future = Future()
+
+
+class AdmissionController:
+    """
+    Keeps counters of running internal/external jobs.
+    Slot is reserved atomically on admission and released when job is ended.
+    Jobs that don't fit into limits wait in queue: internal jobs go first,
+    within each class clients are served in round-robin order (fair share).
+    Queue length and wait time are limited
+    """
+
+    def __init__(self, counts, max_queue: int = 100, max_wait: float = 600.0):
+        # NOTE: counts is callable, that returns current limits (all_count, i_count, e_count)
+        self._counts = counts
+        self._max_queue = max_queue
+        self._max_wait = max_wait
+        self._lock = threading.Lock()
+        self._reserved = {}
+        self._internal = 0
+        self._external = 0
+        self._queues = {True: OrderedDict(), False: OrderedDict()}
+        self._queued = {}
+
+    @property
+    def internal(self) -> int:
+        return self._internal
+
+    @property
+    def external(self) -> int:
+        return self._external
+
+    @property
+    def total(self) -> int:
+        return self._internal + self._external
+
+    @property
+    def queued(self) -> int:
+        return len(self._queued)
+
+    def _check(self, type_request: bool, counts: dict) -> str | None:
+        if self._internal + self._external >= counts["all_count"]:
+            return "Превышен общий лимит запросов"
+        if type_request and self._internal >= counts["i_count"]:
+            return "Превышен лимит внутренних запросов"
+        if not type_request and self._external >= counts["e_count"]:
+            return "Превышен лимит внешних запросов"
+        return None
+
+    def _take(self, token: int, type_request: bool) -> None:
+        if type_request:
+            self._internal += 1
+        else:
+            self._external += 1
+        self._reserved[token] = type_request
+
+    def reserve(self, token: int, type_request: bool, counts: dict) -> tuple[bool, str | None]:
+        """
+        Reserve slot for job with token if limits from counts allows it
+        """
+        with self._lock:
+            err_msg = self._check(type_request, counts)
+            if err_msg is None:
+                self._take(token, type_request)
+                return True, None
+        return False, err_msg
+
+    def release(self, token: int) -> None:
+        """
+        Release slot reserved for token (does nothing if it's released already) and start queued jobs
+        """
+        with self._lock:
+            if token not in self._reserved:
+                return
+            if self._reserved.pop(token):
+                self._internal -= 1
+            else:
+                self._external -= 1
+        self.dispatch()
+
+    def admit(self, token: int, type_request: bool, client: str, start, drop) -> tuple[bool, str | None, int | None]:
+        """
+        Put job into queue and start queued jobs while there are free slots
+        Returns position of the job in queue (0 - job is started already)
+        """
+        with self._lock:
+            if len(self._queued) >= self._max_queue:
+                return False, "Очередь запросов заполнена", None
+            job = QueuedJob(token, type_request, client, self._max_wait, start, drop)
+            self._queues[type_request].setdefault(client, deque()).append(job)
+            self._queued[token] = job
+        self.dispatch()
+        position = self.position(token)
+        return True, None, 0 if position is None else position
+
+    def _next(self, counts: dict) -> QueuedJob | None:
+        for type_request in (True, False):
+            clients = self._queues[type_request]
+            if not clients or self._check(type_request, counts) is not None:
+                continue
+            client, jobs = next(iter(clients.items()))
+            job = jobs.popleft()
+            if jobs:
+                clients.move_to_end(client)
+            else:
+                del clients[client]
+            del self._queued[job.token]
+            self._take(job.token, job.type_request)
+            return job
+        return None
+
+    def _remove(self, job: QueuedJob) -> None:
+        jobs = self._queues[job.type_request][job.client]
+        jobs.remove(job)
+        if not jobs:
+            del self._queues[job.type_request][job.client]
+        del self._queued[job.token]
+
+    def dispatch(self) -> None:
+        """
+        Drop expired jobs and start queued jobs while limits allow it
+        """
+        now = time.time()
+        with self._lock:
+            expired = [job for job in self._queued.values() if job.deadline <= now]
+            for job in expired:
+                self._remove(job)
+        for job in expired:
+            job.future.set_result(False)
+            job.drop("Превышено время ожидания в очереди")
+        counts = self._counts()
+        while True:
+            with self._lock:
+                job = self._next(counts)
+            if job is None:
+                break
+            job.start()
+            job.future.set_result(True)
+
+    def cancel(self, token: int) -> bool:
+        """
+        Remove job from queue, returns False if it's not queued
+        """
+        with self._lock:
+            job = self._queued.get(token)
+            if job is None:
+                return False
+            self._remove(job)
+        job.future.set_result(False)
+        job.drop("Запрос отменён")
+        return True
+
+    def waiter(self, token: int) -> Future | None:
+        """
+        Future of queued job, it's result is True when job is started (False if it's dropped)
+        """
+        job = self._queued.get(token)
+        return None if job is None else job.future
+
+    def position(self, token: int) -> int | None:
+        """
+        Position of job in queue (starting from 1), None if it's not queued
+        """
+        with self._lock:
+            job = self._queued.get(token)
+            if job is None:
+                return None
+            position = 1
+            if not job.type_request:
+                position += sum(len(jobs) for jobs in self._queues[True].values())
+            clients = self._queues[job.type_request]
+            own = list(clients).index(job.client)
+            index = clients[job.client].index(job)
+            for k, (client, jobs) in enumerate(clients.items()):
+                if client == job.client:
+                    position += index
+                else:
+                    # NOTE: round-robin, clients before job's client get one turn more
+                    position += min(len(jobs), index + (1 if k < own else 0))
+            return position
+
+    def queue_info(self, token: int) -> dict | None:
+        job = self._queued.get(token)
+        position = self.position(token)
+        if job is None or position is None:
+            return None
+        return {"position": position, "waiting": time.time() - job.enqueued, "deadline": job.deadline}
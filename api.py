@@ -1,19 +1,40 @@
-from fastapi import FastAPI, Request
+import json
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from funcs_for_nodes import start_running, get_data, stop_process, get_data_for_process, fill_list
+from helpers import to_json
+from funcs_for_nodes import start_running, get_data, stop_process, wait_process, get_data_for_process, fill_list, \
+    follow_process, get_history, put_blob, has_blob, get_queue_info, get_usage, get_usage_stats, event_bus, engine, \
+    shards, stop_all
 
 
 class RequestInfo(BaseModel):
     task_type: str
     task_args: dict
     task_env: dict
+    task_files: dict = {}  # NOTE: path in job root -> digest of uploaded blob (see /blobs)
 
 
 class RequestToken(BaseModel):
     token: int
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    engine.start()
+    if shards is not None:
+        shards.start()
+    yield
+    try:
+        await engine.run(stop_all())
+    finally:
+        engine.shutdown(wait=False)
+    if shards is not None:
+        shards.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.post("/start")
@@ -22,14 +43,44 @@ async def start(tasks: RequestInfo, request: Request) -> tuple[bool, str | None,
     return success, msg, process_token
 
 
+@app.put("/blobs")
+async def upload_blob(request: Request, digest: str | None = None) -> tuple[bool, str | None, str | None]:
+    # NOTE: body is raw file data, it's streamed into blobs store, result is digest (sha256) of the file.
+    # If digest is specified, it's checked against data
+    success, msg, blob_digest = await put_blob(request.stream(), digest)
+    return success, msg, blob_digest
+
+
+@app.head("/blobs/{digest}")
+async def check_blob(digest: str) -> Response:
+    return Response(status_code=200 if has_blob(digest) else 404)
+
+
 @app.post("/stop")
 async def stop(data: RequestToken) -> None:
     await stop_process(data.token)
 
 
+@app.post("/wait")
+async def wait(data: RequestToken) -> None:
+    await wait_process(data.token)
+
+
 @app.get("/get")
-async def get_info() -> tuple[dict, list]:
-    data = await get_data()
+async def get_info(request: Request, response: Response, since: int | None = None) -> tuple[dict, list]:
+    # NOTE: ETag is version of jobs snapshot, pass it as since to get only jobs changed after it
+    # (jobs that are not in the list anymore should be dropped by client)
+    version, jobs, order = await get_data(since)
+    etag = f'"{version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return jobs, order
+
+
+@app.get("/queue/{token}")
+async def get_queue_position(token: int) -> tuple[dict | None, str | None]:
+    data = await get_queue_info(token)
     return data
 
 
@@ -39,6 +90,99 @@ async def get_info_of_process(token: int) -> tuple[dict | None, str | None]:
     return data
 
 
+@app.get("/process/{token}/usage")
+async def get_usage_of_process(token: int) -> tuple[dict | None, str | None]:
+    # NOTE: usage - final resource usage (current one while job is running), samples - series of
+    # [time, cpu time, rss] if sampling is enabled for task type
+    data = await get_usage(token)
+    return data
+
+
+@app.get("/usage")
+async def get_usage_info(since: float | None = None, until: float | None = None) -> dict:
+    data = await get_usage_stats(since, until)
+    return data
+
+
+@app.get("/process/{token}/stream")
+async def stream_process(token: int, request: Request, source: str = "stdout", start: int = 0) -> StreamingResponse:
+    # NOTE: Server-Sent Events, id of each event is index of the next line,
+    # so client can resume with Last-Event-ID header (or start query param)
+    if source not in ("stdout", "stderr"):
+        # NOTE: checked before response is started, errors inside stream are sent as error event
+        return Response(content=json.dumps(f"Неизвестный поток '{source}'", ensure_ascii=False), status_code=400,
+                        media_type="application/json")
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id is not None and last_event_id.isdigit():
+        start = int(last_event_id)
+
+    async def events():
+        position = start
+        while not await request.is_disconnected():
+            data, err_msg = await follow_process(token, source, position)
+            if data is None:
+                yield f"event: error\ndata: {json.dumps(err_msg)}\n\n"
+                return
+            chunk = []
+            # NOTE: ids are counted from resolved position of first line (start may be negative)
+            first = data["next"] - len(data["lines"])
+            for k, (timestamp, line) in enumerate(data["lines"]):
+                if isinstance(line, bytes):
+                    line = line.decode("utf-8", "replace")
+                chunk.append(f"id: {first + k + 1}\ndata: {json.dumps([timestamp, line])}\n\n")
+            position = data["next"]
+            if chunk:
+                yield "".join(chunk)
+            if data["finished"]:
+                yield "event: end\ndata: null\n\n"
+                return
+            if not chunk:
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/events")
+async def stream_events(request: Request, token: int | None = None, task_type: str | None = None) -> StreamingResponse:
+    # NOTE: Server-Sent Events of jobs state changes: queued, started, stopping, exited, error, upload, uploaded
+    # (and lagged, if client is too slow - it should re-read /get then)
+    subscription = event_bus.subscribe(token, task_type)
+
+    async def events():
+        async with subscription:
+            while not await request.is_disconnected():
+                event = await subscription.get(timeout=15.0)
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                event_id = f"id: {event['id']}\n" if event["id"] is not None else ""
+                yield f"{event_id}event: {event['event']}\ndata: {to_json(event).decode()}\n\n"
+                if event["event"] == "lagged":
+                    return
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 @app.get("/fill")
 async def fill_info() -> None:
     fill_list()
+
+
+@app.get("/history")
+async def get_history_info(
+        task_type: str | None = None,
+        ip_request: str | None = None,
+        retcode: int | None = None,
+        active: bool | None = None,
+        since: float | None = None,
+        until: float | None = None,
+        sort: str = "start_time",
+        order: str = "desc",
+        cursor: str | None = None,
+        limit: int = 50,
+) -> tuple[dict | None, str | None]:
+    # NOTE: cursor pagination, pass "next" from response as cursor to get the next page
+    filters = {"task_type": task_type, "ip_request": ip_request, "retcode": retcode, "active": active,
+               "since": since, "until": until}
+    data = await get_history(filters, sort, order, cursor, limit)
+    return data
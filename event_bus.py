@@ -0,0 +1,114 @@
+import time
+import asyncio
+import itertools
+import threading
+from helpers import to_dict
+
+
+class Subscription:
+    """
+    Events of the bus, that match filters, as async iterator (on event loop where it's created).
+    If subscriber is lagging too much (queue is full) it gets 'lagged' event and iteration ends
+    """
+
+    def __init__(self, bus, token: int = None, task_type: str = None, queue_size: int = 1000):
+        self._bus = bus
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._token = token
+        self._task_type = task_type
+        self._lagged = False
+        self.closed = False
+
+    def match(self, event: dict) -> bool:
+        if self._token is not None and event["token"] != self._token:
+            return False
+        if self._task_type is not None and event["task_type"] != self._task_type:
+            return False
+        return True
+
+    def _put(self, event: dict) -> None:
+        if self._lagged:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self._lagged = True
+
+    def put(self, event: dict) -> None:
+        """
+        Pass event to subscriber (from any thread)
+        """
+        if self.closed or not self.match(event):
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # NOTE: subscriber's loop is closed
+            self.close()
+
+    async def get(self, timeout: float = None) -> dict | None:
+        """
+        Next event, None on timeout
+        """
+        if self._lagged and self._queue.empty():
+            self.close()
+            return to_dict(id=None, event="lagged", token=self._token, task_type=self._task_type, time=time.time(),
+                           data={})
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self.closed = True
+        self._bus.unsubscribe(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        if self.closed:
+            raise StopAsyncIteration
+        return await self.get()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+
+class EventBus:
+    """
+    In-process bus of jobs state-change events.
+    Events are published from any thread (engine loop, shard readers),
+    subscribers get them on their own event loops
+    """
+
+    def __init__(self, queue_size: int = 1000):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+        self._queue_size = queue_size
+
+    def publish(self, event: str, data: dict = None, token: int = None, task_type: str = None) -> None:
+        item = to_dict(id=next(self._ids), event=event, token=token, task_type=task_type, time=time.time(),
+                       data=data or {})
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.put(item)
+
+    def subscribe(self, token: int = None, task_type: str = None) -> Subscription:
+        """
+        Subscribe to events (filtered by token and/or task type), should be called from event loop
+        """
+        subscription = Subscription(self, token, task_type, self._queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
@@ -1,86 +1,184 @@
 import os
-import yaml
+import time
 import datetime
-import shutil
-import threading
 import asyncio
+import functools
+import threading
 from uuid_extensions import uuid7
 from CmdType import get_params
 from timetable_for_web import get_counts
-from node_runner_general import NodeRunner
+from node_runner_general import NodeRunner, OutputCapture
+from job_engine import JobEngine
+from admission import AdmissionController
+from node_shards import ShardPool
+from job_store import JobStore
+from snapshot import StateSnapshot
+from event_bus import EventBus
+from workspaces import Workspaces
+from uploads import upload_engine, ContentStore
 from pathlib import Path
 
 dict_of_nodes = {}
 list_of_nodes = []
+engine = JobEngine()
+# NOTE: jobs over limits wait in queue of NODE_QUEUE_SIZE jobs at most, for NODE_QUEUE_WAIT seconds at most
+admission = AdmissionController(
+    get_counts,
+    int(os.environ.get("NODE_QUEUE_SIZE", "100")),
+    float(os.environ.get("NODE_QUEUE_WAIT", "600")),
+)
+_ticker_lock = threading.Lock()
+_ticker_running = False
+# NOTE: (token, stream) -> OutputCapture over log file of listed job, whose runner is gone
+_finished_logs = {}
+_finished_logs_lock = threading.Lock()
+snapshot = StateSnapshot()
+event_bus = EventBus()
+workspaces = Workspaces(Path(__file__).parent / "logs", Path(__file__).parent / "seeds")
+# NOTE: input files for jobs, uploaded once and referred by digest in /start
+input_store = ContentStore(Path(__file__).parent / "blobs", upload_engine)
+
+# NOTE: set NODE_SHARDS to run NodeRunners in a pool of worker processes (0 - run in this process)
+SHARDS = int(os.environ.get("NODE_SHARDS", "0"))
+shards = ShardPool(SHARDS) if SHARDS > 0 else None
+
+job_store = JobStore(Path(__file__).parent / "jobs.sqlite3")
+if job_store.created:
+    job_store.import_yaml(Path(__file__).parent / "dumps", Path(__file__).parent / "logs")
+job_store.mark_interrupted()
+
+
+def job_summary(job: dict) -> dict:
+    if job["dump"] is not None:
+        process_info = job["dump"]["process_info"]["data"]["process_info"]
+        run_info = job["dump"]["run_info"]["data"]["run_info"]
+        cmd, cwd, root = process_info["cmd"], process_info["cwd"], process_info["root"]
+        end_time = run_info["end_time"]
+        cpu_time = run_info.get("cpu_time")
+        max_rss = (run_info.get("usage") or {}).get("max_rss")
+    else:
+        cmd = job["start_log"]["params"]["cmd"] if job["start_log"] else None
+        cwd = root = end_time = cpu_time = max_rss = None
+    return {"token_process": job["token"],
+            "task_type": job["task_type"],
+            "cmd": cmd,
+            "ip_request": job["ip_request"],
+            "cwd": cwd,
+            "root": root,
+            "active": bool(job["active"]),
+            "start_time": job["start_time"],
+            "end_time": end_time,
+            "retcode": job["retcode"],
+            "cpu_time": cpu_time,
+            "max_rss": max_rss}
 
 
 def fill_list() -> None:
     if len(list_of_nodes) != 20:
-        path = Path(__file__).parent / "dumps"
-        files = sorted([[f, os.path.getmtime(path / str(f))] for f in os.listdir(path)], key=lambda x: x[1])
-        for f, t in files[::-1][:20]:
-            file_path_1 = path / str(f)
-            file_path_2 = path.parent / "logs" / str(f).replace(".yaml", "") / "start_log.yaml"
-
-            with open(file_path_1, "r") as file:
-                data_1 = yaml.safe_load(file)
-
-            with open(file_path_2, "r") as file:
-                data_2 = yaml.safe_load(file)
-
-            if int(data_2["token_process"]) not in dict_of_nodes:
-                list_of_nodes.insert(0, int(data_2["token_process"]))
-
-                dict_of_nodes[data_2["token_process"]] = {"task_type": data_2["task_type"],
-                                                          "cmd": data_2["params"]["cmd"],
-                                                          "ip_request": data_2["ip_request"],
-                                                          "cwd": data_1["process_info"]["data"]["process_info"]["cwd"],
-                                                          "root": data_1["process_info"]["data"]["process_info"]["root"],
-                                                          "active": data_1["run_info"]["data"]["run_info"]["active"],
-                                                          "end_time": data_1["run_info"]["data"]["run_info"]["end_time"],
-                                                          "retcode": data_1["run_info"]["data"]["run_info"]["retcode"],
-                                                          "object": None}
-
-
-def start_waiting_process(token_process, output_path, result, ip_request, type_request, task_type) -> None:
-    async def end_process() -> None:
-        nr = NodeRunner(
-            output_path,
-            max_runtime=result["max_runtime"],
-            terminate_timeout=result["terminate_timeout"],
-            encoding=result["encoding"]
-        )
-
-        dict_of_nodes[token_process] = {"object": nr,
-                                        "task_type": task_type,
-                                        "params": result,
-                                        "type_request": type_request,
-                                        "ip_request": ip_request}
-
-        success, _ = await nr.run(
-            cmd=result["cmd"],
-            shell=result["shell"],
-            env=result["env"],
-            cwd=output_path,
-            files=result["files"],
-            artifacts=result["artifacts"],
-            logs=result["logs"]
-        )
-
-        write_log(output_path, token_process)
-        await dict_of_nodes[token_process]["object"].wait()
-        await dict_of_nodes[token_process]["object"].exit()
-
-        dump_path = make_path_for_dump(__file__)
-        await write_dump(dump_path, token_process, task_type)
-
-    asyncio.run(end_process())
+        for job in job_store.query(limit=20):
+            if job["dump"] is None or job["token"] in dict_of_nodes:
+                continue
+            list_of_nodes.insert(0, job["token"])
+
+            summary = job_summary(job)
+            dict_of_nodes[job["token"]] = {key: summary[key] for key in
+                                           ("task_type", "cmd", "ip_request", "cwd", "root", "active", "end_time",
+                                            "retcode", "cpu_time", "max_rss")}
+            dict_of_nodes[job["token"]]["object"] = None
+            snapshot.update(job["token"], summary_of(job["token"]), first=True)
+
+
+async def get_history(filters: dict, sort: str, order: str, cursor: str | None,
+                      limit: int) -> tuple[dict | None, str | None]:
+    if order not in ("asc", "desc"):
+        return None, "Неизвестный порядок сортировки"
+    try:
+        jobs, next_cursor = job_store.page(**filters, sort=sort, descending=order == "desc", cursor=cursor,
+                                           limit=limit)
+    except (ValueError, TypeError) as e:
+        return None, f"Неверные параметры запроса: {e}"
+    return {"jobs": [job_summary(job) for job in jobs], "next": next_cursor}, None
+
+
+async def start_waiting_process(token_process, output_path, result, task_type) -> None:
+    # NOTE: node record is taken once, so logs are written even if job is dropped from list meanwhile
+    node = dict_of_nodes[token_process]
+    nr = node["object"]
+
+    try:
+        # NOTE: job root is materialized here (not in /start request) on default executor
+        await asyncio.get_running_loop().run_in_executor(None, workspaces.create, output_path, result["seed"])
+    except Exception as e:
+        print(f"[INFO] Failed to prepare workspace for process {token_process}: {e}")
+        drop_process(token_process, task_type, f"Не удалось подготовить рабочую папку: {e}")
+        admission.release(token_process)
+        return
+
+    try:
+        try:
+            success, _ = await nr.run(
+                cmd=result["cmd"],
+                shell=result["shell"],
+                env=result["env"],
+                cwd=output_path,
+                files=result["files"],
+                artifacts=result["artifacts"],
+                logs=result["logs"],
+                blobs=result["blobs"],
+                blob_store=str(input_store.root)
+            )
+
+            write_log(token_process, node)
+            await refresh_snapshot(token_process)
+            # NOTE: if process is failed to start there is nothing to wait for, it's failure is in dump
+            if success:
+                await nr.wait()
+            await nr.exit()
+        finally:
+            admission.release(token_process)
+            await refresh_snapshot(token_process)
+
+        await write_dump(token_process, node)
+    finally:
+        # NOTE: finished job may be dropped from list now (it's workspace is released then)
+        node["finished"] = True
+        if shards is not None:
+            # NOTE: runner in shard is dropped only when dump is written, then job's data are read from dump
+            node["object"] = None
+            nr.release()
+
+
+def make_runner(token_process: int, output_path: Path | str, result: dict, task_type: str):
+    kwargs = {
+        "max_runtime": result["max_runtime"],
+        "terminate_timeout": result["terminate_timeout"],
+        "encoding": result["encoding"],
+        "on_exit": functools.partial(admission.release, token_process),
+        "on_event": functools.partial(event_bus.publish, token=token_process, task_type=task_type)
+    }
+    for key in ("log_lines", "capture", "warm", "warm_preload", "sample_interval", "limits"):
+        if result.get(key) is not None:
+            kwargs[key] = result[key]
+    if shards is not None:
+        return shards.runner(token_process, output_path, **kwargs)
+    return NodeRunner(output_path, **kwargs)
 
 
 def check_list_count() -> None:
+    # NOTE: only finished jobs are dropped from the list, queued and running jobs are kept
+    # (so list may be longer than max_length while they're there)
     max_length = 20
-    if len(list_of_nodes) >= max_length:
-        del dict_of_nodes[list_of_nodes.pop()]
+    for token in reversed(list(list_of_nodes)):
+        if len(list_of_nodes) < max_length:
+            break
+        if dict_of_nodes[token]["object"] is not None and not dict_of_nodes[token].get("finished"):
+            continue
+        list_of_nodes.remove(token)
+        node = dict_of_nodes.pop(token)
+        snapshot.remove(token)
+        for stream in ("stdout", "stderr"):
+            _finished_logs.pop((token, stream), None)
+        workspaces.release(node.get("workspace", node.get("root")))
 
 
 def get_token() -> int:
@@ -88,24 +186,6 @@ def get_token() -> int:
     return token.int
 
 
-def make_path_for_log(file_path: Path | str, token: str) -> Path | str:
-    output_path = Path(file_path).parent / "logs" / token
-    if not output_path.exists():
-        os.makedirs(output_path)
-    shutil.copy2(
-        Path(__file__).parent / "test.py",
-        output_path / "test.py"
-    )
-    return output_path
-
-
-def make_path_for_dump(file_path: Path | str) -> Path | str:
-    output_path = Path(file_path).parent / "dumps"
-    if not output_path.exists():
-        os.makedirs(output_path)
-    return output_path
-
-
 def get_type_request(ip: str) -> bool:
     if ip == "127.0.0.1":
         return True
@@ -113,132 +193,280 @@ def get_type_request(ip: str) -> bool:
         return False
 
 
-def write_log(path: Path | str, token: int) -> None:
-    file_path = path / "start_log.yaml"
+def write_log(token: int, node: dict) -> None:
     info = {
         "token_process": token,
         "start_time": str(datetime.datetime.today()),
-        "ip_request": dict_of_nodes[token]["ip_request"],
-        "type_request": dict_of_nodes[token]["type_request"],
-        "params": dict_of_nodes[token]["params"],
-        "task_type": dict_of_nodes[token]["task_type"]
+        "ip_request": node["ip_request"],
+        "type_request": node["type_request"],
+        "params": node["params"],
+        "task_type": node["task_type"]
     }
-    with open(file_path, "w") as file:
-        yaml.safe_dump(info, file)
+    job_store.write_log(token, time.time(), info)
 
 
-async def write_dump(path: Path | str, token: int, task_type: str) -> None:
-    file_path = path / f"{token}.yaml"
-    success_process, data_process = await dict_of_nodes[token]["object"].process_info(False)
-    success_run, data_run = await dict_of_nodes[token]["object"].run_info(False)
+async def write_dump(token: int, node: dict) -> None:
+    success_process, data_process = await node["object"].process_info(False)
+    success_run, data_run = await node["object"].run_info(False)
+    success_usage, data_usage = await node["object"].usage()
     info = {
         "token_process": token,
         "end_time": str(datetime.datetime.today()),
-        "ip_request": dict_of_nodes[token]["ip_request"],
-        "task_type": task_type,
+        "ip_request": node["ip_request"],
+        "task_type": node["task_type"],
         "text": "Process completed",
         "process_info": data_process,
-        "run_info": data_run
+        "run_info": data_run,
+        "usage": data_usage
     }
-    with open(file_path, "w") as file:
-        yaml.safe_dump(info, file)
-
-
-async def check_active_process(type_request: bool) -> tuple[bool, str | None]:
-    iactive_count = 0
-    eactive_count = 0
-    counts = get_counts()
-
-    for element in dict_of_nodes:
-        if dict_of_nodes[element]["object"]:
-            success, d = await dict_of_nodes[element]["object"].run_info(False)
-            active_bool = d["data"]["run_info"]["active"]
-
-            if active_bool:
-                if dict_of_nodes[element]["type_request"]:
-                    iactive_count += 1
-                else:
-                    eactive_count += 1
-
-    if iactive_count + eactive_count < counts["all_count"]:
-        if type_request:
-            if iactive_count < counts["i_count"]:
-                return True, None
-            else:
-                err_msg = "Превышен лимит внутренних запросов"
-        else:
-            if eactive_count < counts["e_count"]:
-                return True, None
-            else:
-                err_msg = "Превышен лимит внешних запросов"
-    else:
-        err_msg = "Превышен общий лимит запросов"
+    job_store.write_dump(token, info)
+
+
+def launch_process(token_process: int, output_path: Path, result: dict, task_type: str) -> None:
+    # NOTE: called by admission (from any thread) when slot is reserved for the job
+    engine.submit(start_waiting_process(token_process, output_path, result, task_type), key=token_process)
+
+
+def drop_process(token_process: int, task_type: str, reason: str) -> None:
+    event_bus.publish("dropped", {"reason": reason}, token=token_process, task_type=task_type)
+    if token_process in dict_of_nodes:
+        node = dict_of_nodes[token_process]
+        node["finished"] = True
+        snapshot.update(token_process, {**summary_of(token_process), "active": False})
+        if shards is not None:
+            # NOTE: job is never started, so it's runner may be dropped right away
+            node["object"].release()
+            node["object"] = None
 
-    return False, err_msg
+
+def queue_tick() -> None:
+    # NOTE: limits depend on timetable and queued jobs expire, so queue is checked periodically while it's not empty
+    global _ticker_running
+    admission.dispatch()
+    with _ticker_lock:
+        if admission.queued == 0:
+            _ticker_running = False
+            return
+    engine.loop.call_later(1.0, queue_tick)
+
+
+def ensure_queue_ticker() -> None:
+    global _ticker_running
+    with _ticker_lock:
+        if not _ticker_running:
+            _ticker_running = True
+            engine.loop.call_soon_threadsafe(engine.loop.call_later, 1.0, queue_tick)
 
 
 async def start_running(params: dict, ip_request: str) -> tuple[bool, str | None, int | None]:
     task_type = params["task_type"]
     task_args = params["task_args"]
     task_env = params["task_env"]
+    task_files = params.get("task_files") or {}
+
+    for digest in task_files.values():
+        if not input_store.has(str(digest)):
+            err_msg = f"Нет загруженного файла {digest}"
+            return False, err_msg, None
 
     type_request = get_type_request(ip_request)
-    check, err_msg = await check_active_process(type_request)
+    token_process = get_token()
+    check, err_msg, result = get_params(task_type, task_args, task_env)
 
     if check:
-        token_process = get_token()
-        output_path = make_path_for_log(__file__, str(token_process))
-        check_2, err_msg, result = get_params(task_type, task_args, task_env)
+        result["blobs"] = {str(k): str(v) for k, v in task_files.items()}
+        output_path = workspaces.path_for(str(token_process), result["workspace"] == "tmpfs")
+        check_list_count()
+        dict_of_nodes[token_process] = {"object": make_runner(token_process, output_path, result, task_type),
+                                        "task_type": task_type,
+                                        "params": result,
+                                        "type_request": type_request,
+                                        "ip_request": ip_request,
+                                        "workspace": output_path}
+        list_of_nodes.insert(0, token_process)
+        snapshot.update(token_process, summary_of(token_process), first=True)
+        event_bus.publish("queued", token=token_process, task_type=task_type)
+
+        check_2, err_msg, position = admission.admit(
+            token_process,
+            type_request,
+            ip_request,
+            functools.partial(launch_process, token_process, output_path, result, task_type),
+            functools.partial(drop_process, token_process, task_type),
+        )
 
         if check_2:
-            check_list_count()
-            list_of_nodes.insert(0, token_process)
-
-            daemon_thread = threading.Thread(target=start_waiting_process, kwargs={"token_process": token_process,
-                                                                                   "output_path": output_path,
-                                                                                   "result": result,
-                                                                                   "ip_request": ip_request,
-                                                                                   "type_request": type_request,
-                                                                                   "task_type": task_type})
-            daemon_thread.start()
-
+            if position:
+                ensure_queue_ticker()
+                return True, f"Запрос в очереди, позиция {position}", token_process
             return True, None, token_process
 
+        list_of_nodes.remove(token_process)
+        node = dict_of_nodes.pop(token_process)
+        snapshot.remove(token_process)
+        event_bus.publish("dropped", {"reason": err_msg}, token=token_process, task_type=task_type)
+        if shards is not None:
+            node["object"].release()
+
     return False, err_msg, None
 
 
-async def get_data() -> tuple[dict, list]:
-    d = {}
-    l = []
-    for key in list_of_nodes:
-        l.append(key)
-        if dict_of_nodes[key]["object"]:
-            success_process, data_process = await dict_of_nodes[key]["object"].process_info(False)
-            success_run, data_run = await dict_of_nodes[key]["object"].run_info(False)
-            d[key] = {
-                "task_type": dict_of_nodes[key]["task_type"],
-                "cmd": dict_of_nodes[key]["params"]["cmd"],
-                "ip_request": dict_of_nodes[key]["ip_request"],
-                "cwd": data_process["data"]["process_info"]["cwd"],
-                "root": data_process["data"]["process_info"]["root"],
-                "active": data_run["data"]["run_info"]["active"],
-                "end_time": data_run["data"]["run_info"]["end_time"],
-                "retcode": data_run["data"]["run_info"]["retcode"]
-            }
-        else:
-            d[key] = dict_of_nodes[key]
-    return d, l
+def summary_of(token: int, data_process: dict = None, data_run: dict = None) -> dict:
+    node = dict_of_nodes[token]
+    if node["object"] is None:
+        return {k: v for k, v in node.items() if k != "object"}
+    process_info = data_process["data"]["process_info"] if data_process else {}
+    run_info = data_run["data"]["run_info"] if data_run else {}
+    usage = run_info.get("usage") or {}
+    return {
+        "task_type": node["task_type"],
+        "cmd": node["params"]["cmd"],
+        "ip_request": node["ip_request"],
+        "cwd": process_info.get("cwd"),
+        "root": process_info.get("root"),
+        "active": run_info.get("active"),
+        "end_time": run_info.get("end_time"),
+        "retcode": run_info.get("retcode"),
+        "cpu_time": run_info.get("cpu_time"),
+        "max_rss": usage.get("max_rss")
+    }
+
+
+async def refresh_snapshot(token: int) -> None:
+    if token not in dict_of_nodes:
+        return
+    nr = dict_of_nodes[token]["object"]
+    if nr is None:
+        return
+    success_process, data_process = await nr.process_info(False)
+    success_run, data_run = await nr.run_info(False)
+    snapshot.update(token, summary_of(token, data_process, data_run))
+
+
+async def get_data(since: int = None) -> tuple[int, dict, list]:
+    # NOTE: summaries are refreshed on state transitions of jobs, so it's just a read of snapshot
+    return snapshot.get(since)
+
+
+async def put_blob(chunks, expected: str | None) -> tuple[bool, str | None, str | None]:
+    # NOTE: chunks are written on upload workers pool by ~1 MiB, so event loop is not blocked
+    writer = await upload_engine.run(input_store.new_blob)
+    buffer = bytearray()
+    try:
+        async for chunk in chunks:
+            buffer += chunk
+            if len(buffer) >= 2 ** 20:
+                await upload_engine.run(writer.write, bytes(buffer))
+                buffer.clear()
+        await upload_engine.run(writer.write, bytes(buffer))
+        digest, size = await upload_engine.run(writer.commit, expected)
+    except ValueError:
+        err_message = "Хэш файла не совпадает"
+        return False, err_message, None
+    except BaseException:
+        writer.abort()
+        raise
+    return True, None, digest
+
+
+def has_blob(digest: str) -> bool:
+    return input_store.has(digest)
 
 
 async def stop_process(token: int) -> None:
-    await dict_of_nodes[token]["object"].stop()
+    if admission.cancel(token):
+        return
+    if token in dict_of_nodes and dict_of_nodes[token]["object"]:
+        await engine.run(dict_of_nodes[token]["object"].stop())
+
+
+async def stop_all() -> None:
+    # NOTE: called (on engine loop) on server shutdown: queued jobs are dropped, running ones are stopped
+    # and waited for, so their dumps are written before engine loop is stopped.
+    # Job may be still preparing it's process when it's checked, so it's checked again until all jobs are done
+    for token in list(list_of_nodes):
+        admission.cancel(token)
+    while engine.jobs():
+        tokens = engine.jobs()
+        runners = [dict_of_nodes[token]["object"] for token in tokens
+                   if token in dict_of_nodes and dict_of_nodes[token]["object"] is not None]
+        await asyncio.gather(*[nr.ensure_stopped() for nr in runners], return_exceptions=True)
+        await asyncio.wait([asyncio.ensure_future(engine.join(token)) for token in tokens], timeout=1.0)
+
+
+async def wait_process(token: int) -> None:
+    waiter = admission.waiter(token)
+    if waiter is not None and not await asyncio.wrap_future(waiter):
+        return
+    await engine.join(token)
+
+
+async def get_queue_info(token: int) -> tuple[dict | None, str | None]:
+    info = admission.queue_info(token)
+    if info is None:
+        err_message = "Такого запроса в очереди нет"
+        return None, err_message
+    return info, None
+
+
+def read_finished_log(token: int, stream: str, start: int, limit: int = 1000) -> dict | None:
+    # NOTE: output of listed job, whose runner is gone (released runner in shard, job loaded from history),
+    # is read from it's log file, same way as follow does (but times of lines are unknown)
+    node = dict_of_nodes.get(token)
+    if node is None or node["object"] is not None:
+        return None
+    with _finished_logs_lock:
+        capture = _finished_logs.get((token, stream))
+        if capture is None:
+            root = node.get("workspace", node.get("root"))
+            if root is None or not (Path(root) / f".{stream}").exists():
+                return None
+            capture = _finished_logs[(token, stream)] = OutputCapture.from_file(
+                Path(root) / f".{stream}", node.get("params", {}).get("log_lines", 10000)
+            )
+        if start < 0:
+            start = max(len(capture) + start, 0)
+        lines = [(None, bytes(line)) for _, line in capture.lines(start, start + limit)]
+        next_line = start + len(lines)
+        return {"lines": lines, "next": next_line, "finished": next_line >= len(capture)}
+
+
+async def follow_process(token: int, stream: str, start: int) -> tuple[dict | None, str | None]:
+    if token in dict_of_nodes and dict_of_nodes[token]["object"]:
+        success, data = await engine.run(dict_of_nodes[token]["object"].follow(stream, start, time_format=None))
+        return data["data"], None
+    # NOTE: log is indexed on first read, so it's read on default executor
+    data = await asyncio.get_running_loop().run_in_executor(None, read_finished_log, token, stream, start)
+    if data is not None:
+        return data, None
+    else:
+        err_message = "Такого процесса нет"
+        return None, err_message
 
 
-async def get_data_for_process(token: int) -> tuple[dict | None, str | None]:
-    dump_path = make_path_for_dump(__file__)
-    path = dump_path / f"{token}.yaml"
+async def get_usage(token: int) -> tuple[dict | None, str | None]:
+    if token in dict_of_nodes and dict_of_nodes[token]["object"]:
+        success, data = await engine.run(dict_of_nodes[token]["object"].usage())
+        return data["data"], None
+
+    data = job_store.get_dump(token)
+    if data is not None:
+        if data.get("usage") is not None:
+            return data["usage"]["data"], None
+        run_info = data["run_info"]["data"]["run_info"]
+        return {"usage": run_info.get("usage"), "samples": None}, None
+    else:
+        err_message = "Такого процесса нет"
+        return None, err_message
+
+
+async def get_usage_stats(since: float | None, until: float | None) -> dict:
+    # NOTE: totals per task type, to size limits in setting_time.yaml and to find heavy task types
+    return job_store.usage_by_task_type(since, until)
 
-    if token in dict_of_nodes:
+
+async def get_data_for_process(token: int) -> tuple[dict | None, str | None]:
+    if token in dict_of_nodes and dict_of_nodes[token]["object"]:
         success_process, data_process = await dict_of_nodes[token]["object"].process_info(False)
         success_run, data_run = await dict_of_nodes[token]["object"].run_info(False)
         data = {
@@ -250,9 +478,9 @@ async def get_data_for_process(token: int) -> tuple[dict | None, str | None]:
             "run_info": data_run
         }
         return data, None
-    elif path.exists():
-        with open(path, "r") as file:
-            data = yaml.safe_load(file)
+
+    data = job_store.get_dump(token)
+    if data is not None:
         return data, None
     else:
         err_message = "Такого процесса нет"
@@ -1,6 +1,7 @@
 from pathlib import Path
 import socket
 import inspect
+import json
 
 
 TCP_RECEIVE_SIZE = 1452
@@ -31,10 +32,35 @@ def socket_receive(sock:socket.socket, size:int, scalar:dict=None):
     return result
 
 
+_SCALARS = frozenset((type(None), int, float, bool, str))
+_SCHEMAS = {}
+
+
 class Dictable:
+    """
+    Base for info classes, that are reported as dicts.
+    Subclasses should declare __slots__, public fields (slots and properties) are found once per class
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def _schema(cls) -> tuple:
+        schema = _SCHEMAS.get(cls)
+        if schema is None:
+            fields = []
+            for k in dir(cls):
+                if k[:1] == "_":
+                    continue
+                attr = inspect.getattr_static(cls, k)
+                if isinstance(attr, property) or inspect.ismemberdescriptor(attr) or not callable(attr):
+                    fields.append(k)
+            schema = tuple(fields)
+            _SCHEMAS[cls] = schema
+        return schema
 
     def _conv_value(self, value, conv_to_str: bool):
-        if value is None:
+        if type(value) in _SCALARS:
             return value
         if isinstance(value, (int, float, bool, str,)):
             return value
@@ -51,15 +77,42 @@ class Dictable:
         return value
 
     def to_dict(self, conv_to_str: bool) -> dict:
+        conv = self._conv_value
         result = {}
-        for k in dir(self):
-            if k[:1] == "_":
-                continue
-            if callable(getattr(self, k)):
-                continue
-            result[k] = self._conv_value(getattr(self, k), conv_to_str)
+        for k in self._schema():
+            value = getattr(self, k)
+            result[k] = value if type(value) in _SCALARS else conv(value, conv_to_str)
+        extra = getattr(self, "__dict__", None)
+        if extra:
+            # NOTE: subclass without __slots__, it's instance attributes are not in schema
+            for k in sorted(extra):
+                if k[:1] != "_" and k not in result and not callable(extra[k]):
+                    result[k] = conv(extra[k], conv_to_str)
+            result = dict(sorted(result.items()))
         return result
 
+    def to_json(self) -> bytes:
+        """
+        Returns JSON (UTF-8 bytes) of to_dict with values converted to strings
+        """
+        return to_json(self)
+
+
+def _json_default(value):
+    if isinstance(value, Dictable):
+        return value.to_dict(True)
+    if isinstance(value, tuple):
+        return list(value)
+    return str(value)
+
+
+def to_json(value) -> bytes:
+    """
+    Serialize value to JSON (UTF-8 bytes), Dictable instances are serialized via their schema,
+    any other unknown values are converted to strings
+    """
+    return json.dumps(value, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode()
+
 
 def any_to_dict_list_scalar(inst, instance_map=None, lists_as_tuple=True):
     # NOTE: source from https://github.com/Godhart/vdf/blob/main/src/helpers.py
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class JobEngine:
+    """
+    Hosts all jobs (NodeRunner lifecycles) as tasks on one long-lived event loop.
+    The loop runs in a background thread, so callers from any thread or loop
+    can submit jobs and await results through submit()/run()/join()
+    """
+
+    def __init__(self, name: str = "job-engine"):
+        self._name = name
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._jobs = {}
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        self.start()
+        return self._loop
+
+    def start(self) -> None:
+        """
+        Start engine loop (does nothing if it is running already)
+        """
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            ready = threading.Event()
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._serve, args=(ready,), name=self._name, daemon=True)
+            self._thread.start()
+            ready.wait()
+
+    def _serve(self, ready: threading.Event) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(ready.set)
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    def _in_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def submit(self, coro, key=None) -> Future:
+        """
+        Schedule coroutine on engine loop and return concurrent future for its result.
+        If key is specified then job can be awaited later with join(key)
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        if key is not None:
+            self._jobs[key] = future
+            future.add_done_callback(lambda _: self._jobs.pop(key, None))
+        return future
+
+    async def run(self, coro):
+        """
+        Run coroutine on engine loop and await it's result from caller's loop
+        """
+        if self._in_loop():
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+    async def join(self, key) -> None:
+        """
+        Wait until job, submitted with key, is done
+        """
+        future = self._jobs.get(key)
+        if future is None:
+            return
+        await asyncio.wrap_future(future)
+
+    def jobs(self) -> list:
+        return list(self._jobs.keys())
+
+    def shutdown(self, wait: bool = True, timeout: float = None) -> None:
+        """
+        Wait for submitted jobs (if wait is True) and stop engine loop
+        """
+        if self._thread is None:
+            return
+        if wait:
+            for future in list(self._jobs.values()):
+                try:
+                    future.result(timeout)
+                except Exception:
+                    pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
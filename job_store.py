@@ -0,0 +1,260 @@
+import os
+import json
+import base64
+import sqlite3
+import datetime
+import threading
+from pathlib import Path
+import yaml
+from helpers import to_json
+
+
+class JobStore:
+    """
+    Indexed local store of jobs history (SQLite in WAL mode)
+    Keeps start log and final dump of each job (as JSON) plus indexed columns for queries
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            token TEXT PRIMARY KEY,
+            start_time REAL,
+            end_time REAL,
+            task_type TEXT,
+            ip_request TEXT,
+            type_request INTEGER,
+            active INTEGER,
+            retcode INTEGER,
+            start_log TEXT,
+            dump TEXT
+        );
+        CREATE INDEX IF NOT EXISTS jobs_start_time ON jobs (start_time);
+        CREATE INDEX IF NOT EXISTS jobs_task_type ON jobs (task_type, start_time);
+        CREATE INDEX IF NOT EXISTS jobs_ip_request ON jobs (ip_request, start_time);
+        CREATE INDEX IF NOT EXISTS jobs_end_time ON jobs (end_time);
+    """
+
+    SORT_COLUMNS = ("start_time", "end_time")
+    MAX_PAGE = 500
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        created = not self.path.exists()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self.created = created
+
+    @staticmethod
+    def _dumps(data: dict) -> str:
+        return to_json(data).decode()
+
+    def _execute(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def write_log(self, token: int, start_time: float, info: dict) -> None:
+        self._execute(
+            """
+            INSERT INTO jobs (token, start_time, task_type, ip_request, type_request, active, start_log)
+            VALUES (?, ?, ?, ?, ?, 1, ?)
+            ON CONFLICT (token) DO UPDATE SET
+                start_time = excluded.start_time,
+                task_type = excluded.task_type,
+                ip_request = excluded.ip_request,
+                type_request = excluded.type_request,
+                start_log = excluded.start_log
+            """,
+            (
+                str(token), start_time, info["task_type"], info["ip_request"],
+                int(bool(info.get("type_request"))), self._dumps(info),
+            )
+        )
+
+    def write_dump(self, token: int, info: dict) -> None:
+        # NOTE: start time of dump (epoch time of process start) takes precedence over start time of start log
+        # (legacy start logs have it as local time string)
+        run_info = info["run_info"]["data"]["run_info"]
+        self._execute(
+            """
+            INSERT INTO jobs (token, start_time, end_time, task_type, ip_request, active, retcode, dump)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (token) DO UPDATE SET
+                start_time = COALESCE(excluded.start_time, start_time),
+                end_time = excluded.end_time,
+                active = excluded.active,
+                retcode = excluded.retcode,
+                dump = excluded.dump
+            """,
+            (
+                str(token), run_info["start_time"], run_info["end_time"], info["task_type"], info["ip_request"],
+                int(run_info["active"] is True), run_info["retcode"], self._dumps(info),
+            )
+        )
+
+    def mark_interrupted(self) -> int:
+        """
+        Mark jobs that are still active as inactive (jobs from legacy start logs without dump
+        or interrupted by restart). Called on start, when no job is running yet
+        Returns number of marked jobs
+        """
+        with self._lock:
+            return self._conn.execute("UPDATE jobs SET active = 0 WHERE active = 1").rowcount
+
+    def get_dump(self, token: int) -> dict | None:
+        rows = self._execute("SELECT dump FROM jobs WHERE token = ?", (str(token),))
+        if not rows or rows[0]["dump"] is None:
+            return None
+        return json.loads(rows[0]["dump"])
+
+    def query(
+            self,
+            task_type: str = None,
+            ip_request: str = None,
+            since: float = None,
+            until: float = None,
+            limit: int = 20,
+    ) -> list[dict]:
+        """
+        Most recent jobs (by start time) matching filters
+        Each item is a dict with columns and parsed start_log/dump
+        """
+        where = []
+        params = []
+        for column, op, value in (
+                ("task_type", "=", task_type),
+                ("ip_request", "=", ip_request),
+                ("start_time", ">=", since),
+                ("start_time", "<", until),
+        ):
+            if value is not None:
+                where.append(f"{column} {op} ?")
+                params.append(value)
+        sql = "SELECT * FROM jobs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY start_time DESC LIMIT ?"
+        params.append(limit)
+        return [self._row(row) for row in self._execute(sql, params)]
+
+    def usage_by_task_type(self, since: float = None, until: float = None) -> dict:
+        """
+        Resource usage of finished jobs (started in [since, until)) aggregated by task type
+        """
+        where = ["dump IS NOT NULL"]
+        params = []
+        for column, op, value in (("start_time", ">=", since), ("start_time", "<", until)):
+            if value is not None:
+                where.append(f"{column} {op} ?")
+                params.append(value)
+        cpu_time = "json_extract(dump, '$.run_info.data.run_info.cpu_time')"
+        # NOTE: max_rss is job's own peak (known for sampled jobs and jobs in cgroup),
+        # max_rss_bound is from rusage and includes RSS of the server at fork (see accounting)
+        max_rss = "json_extract(dump, '$.run_info.data.run_info.usage.max_rss')"
+        max_rss_bound = "json_extract(dump, '$.run_info.data.run_info.usage.max_rss_bound')"
+        sql = f"""
+            SELECT task_type, COUNT(*) AS jobs, COUNT({cpu_time}) AS measured,
+                SUM({cpu_time}) AS cpu_time, AVG({cpu_time}) AS avg_cpu_time, MAX({cpu_time}) AS max_cpu_time,
+                AVG(end_time - start_time) AS avg_runtime, MAX({max_rss}) AS max_rss, AVG({max_rss}) AS avg_max_rss,
+                MAX({max_rss_bound}) AS max_rss_bound
+            FROM jobs WHERE {' AND '.join(where)} GROUP BY task_type ORDER BY cpu_time DESC
+        """
+        return {row["task_type"]: {k: row[k] for k in row.keys() if k != "task_type"}
+                for row in self._execute(sql, params)}
+
+    @staticmethod
+    def encode_cursor(value, token) -> str:
+        return base64.urlsafe_b64encode(json.dumps([value, str(token)]).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple:
+        value, token = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(value, (int, float)) or not isinstance(token, str):
+            raise ValueError(f"Invalid cursor '{cursor}'!")
+        return value, token
+
+    def page(
+            self,
+            task_type: str = None,
+            ip_request: str = None,
+            retcode: int = None,
+            active: bool = None,
+            since: float = None,
+            until: float = None,
+            sort: str = "start_time",
+            descending: bool = True,
+            cursor: str = None,
+            limit: int = 50,
+    ) -> tuple[list[dict], str | None]:
+        """
+        One page of jobs matching filters, sorted by sort column (keyset pagination, so only the page is read)
+        Returns jobs and cursor of the next page (None if it's the last page)
+        Jobs without value in sort column (e.g. end_time of running job) are skipped
+        """
+        if sort not in self.SORT_COLUMNS:
+            raise ValueError(f"Unknown sort column '{sort}'!")
+        limit = max(1, min(limit, self.MAX_PAGE))
+        where = [f"{sort} IS NOT NULL"]
+        params = []
+        for column, op, value in (
+                ("task_type", "=", task_type),
+                ("ip_request", "=", ip_request),
+                ("retcode", "=", retcode),
+                ("active", "=", None if active is None else int(active)),
+                ("start_time", ">=", since),
+                ("start_time", "<", until),
+        ):
+            if value is not None:
+                where.append(f"{column} {op} ?")
+                params.append(value)
+        op = "<" if descending else ">"
+        if cursor is not None:
+            value, token = self.decode_cursor(cursor)
+            where.append(f"({sort} {op} ? OR ({sort} = ? AND token {op} ?))")
+            params += [value, value, token]
+        direction = "DESC" if descending else "ASC"
+        sql = f"SELECT * FROM jobs WHERE {' AND '.join(where)} ORDER BY {sort} {direction}, token {direction} LIMIT ?"
+        params.append(limit + 1)
+        rows = self._execute(sql, params)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.encode_cursor(rows[-1][sort], rows[-1]["token"])
+        return [self._row(row) for row in rows], next_cursor
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> dict:
+        result = dict(row)
+        result["token"] = int(result["token"])
+        for key in ("start_log", "dump"):
+            if result[key] is not None:
+                result[key] = json.loads(result[key])
+        return result
+
+    def import_yaml(self, dumps_path: Path, logs_path: Path) -> None:
+        """
+        Import jobs history from legacy YAML start logs (logs/<token>/start_log.yaml) and dumps (dumps/<token>.yaml)
+        """
+        if logs_path.exists():
+            for f in os.listdir(logs_path):
+                start_log_path = logs_path / f / "start_log.yaml"
+                if not start_log_path.exists():
+                    continue
+                with open(start_log_path, "r") as file:
+                    start_log = yaml.safe_load(file)
+                start_time = datetime.datetime.fromisoformat(str(start_log["start_time"])).timestamp()
+                self.write_log(int(start_log["token_process"]), start_time, start_log)
+        if dumps_path.exists():
+            for f in os.listdir(dumps_path):
+                if not f.endswith(".yaml"):
+                    continue
+                with open(dumps_path / f, "r") as file:
+                    dump = yaml.safe_load(file)
+                self.write_dump(int(dump["token_process"]), dump)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,237 @@
+import os
+import math
+import time
+import threading
+from pathlib import Path
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# NOTE: per task type resource limits ("limits" in commands.yaml):
+#   cpus: "0-3,6"      - CPUs job may run on (cpuset.cpus, sched_setaffinity otherwise)
+#   cpu_weight: 100    - share of CPU time under contention, 1..10000 (cpu.weight, nice otherwise)
+#   cpu_max: 1.5       - CPU bandwidth in cores (cpu.max, cgroup only)
+#   memory_max: 512M   - memory cap (memory.max, RLIMIT_DATA otherwise)
+#   io_weight: 100     - share of disk I/O under contention, 1..10000 (io.weight, cgroup only)
+# Limits are applied with cgroup v2 if NODE_CGROUP points to delegated cgroup (each job gets it's own
+# child cgroup there), with rlimits/affinity/nice in job's process otherwise
+
+
+_UNITS = {"": 1, "K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30, "T": 2 ** 40}
+
+
+def parse_size(value) -> int:
+    """
+    Size in bytes from int or string with K/M/G/T suffix ("512M")
+    """
+    if isinstance(value, int):
+        return value
+    text = str(value).strip().upper().removesuffix("B")
+    unit = text[-1:] if text[-1:] in _UNITS else ""
+    return int(float(text[:len(text) - len(unit)]) * _UNITS[unit])
+
+
+def parse_cpus(value) -> tuple:
+    """
+    CPU numbers from list or string in cpuset format ("0-3,6")
+    """
+    if isinstance(value, int):
+        return value,
+    if isinstance(value, (list, tuple)):
+        return tuple(sorted({int(v) for v in value}))
+    cpus = set()
+    for part in str(value).split(","):
+        start, _, end = part.strip().partition("-")
+        cpus.update(range(int(start), int(end or start) + 1))
+    return tuple(sorted(cpus))
+
+
+class ResourceLimits:
+    """
+    Resource limits of the job (see commands.yaml "limits")
+    """
+
+    __slots__ = ("cpus", "cpu_weight", "cpu_max", "memory_max", "io_weight")
+
+    def __init__(self, cpus=None, cpu_weight: int = None, cpu_max: float = None, memory_max=None,
+                 io_weight: int = None):
+        self.cpus = None if cpus is None else parse_cpus(cpus)
+        self.cpu_weight = None if cpu_weight is None else int(cpu_weight)
+        self.cpu_max = None if cpu_max is None else float(cpu_max)
+        self.memory_max = None if memory_max is None else parse_size(memory_max)
+        self.io_weight = None if io_weight is None else int(io_weight)
+        if self.cpus is not None and not self.cpus:
+            raise ValueError("Empty cpus set!")
+        for name in ("cpu_weight", "io_weight"):
+            if getattr(self, name) is not None and not 1 <= getattr(self, name) <= 10000:
+                raise ValueError(f"{name} should be in range 1..10000!")
+        if self.cpu_max is not None and self.cpu_max <= 0:
+            raise ValueError("cpu_max should be positive!")
+        if self.memory_max is not None and self.memory_max <= 0:
+            raise ValueError("memory_max should be positive!")
+
+    @classmethod
+    def from_config(cls, config: dict | None):
+        """
+        Limits from config dict, None if there are no limits
+        """
+        if not config:
+            return None
+        unknown = set(config) - set(cls.__slots__)
+        if unknown:
+            raise ValueError(f"Unknown limits: {', '.join(sorted(unknown))}!")
+        return cls(**config)
+
+    def to_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__ if getattr(self, k) is not None}
+
+    def nice(self) -> int:
+        # NOTE: same mapping as kernel's: each nice level is ~1.25 times less CPU, weight 100 is nice 0
+        return max(-20, min(19, round(-math.log(self.cpu_weight / 100) / math.log(1.25))))
+
+    def apply(self, cgroup_procs: str = None, applied: tuple = ()) -> None:
+        """
+        Apply limits to the current process: move it into job's cgroup (if any),
+        limits that are not applied by cgroup are applied with rlimits/affinity/nice.
+        Called in child process before exec (or before script is run in warm mode), so it's kept simple
+        """
+        if cgroup_procs is not None:
+            with open(cgroup_procs, "w") as f:
+                f.write("0")
+        if self.cpus is not None and "cpus" not in applied and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, self.cpus)
+        if self.memory_max is not None and "memory_max" not in applied and resource is not None:
+            resource.setrlimit(resource.RLIMIT_DATA, (self.memory_max, self.memory_max))
+        if self.cpu_weight is not None and "cpu_weight" not in applied and hasattr(os, "nice"):
+            try:
+                os.nice(self.nice())
+            except OSError:
+                # NOTE: raising priority is not permitted for unprivileged user
+                pass
+
+
+class JobCgroup:
+    """
+    Child cgroup of a single job
+    """
+
+    def __init__(self, path: Path, applied: tuple):
+        self.path = path
+        self.applied = applied
+
+    @property
+    def procs(self) -> str:
+        return str(self.path / "cgroup.procs")
+
+    def _read(self, name: str) -> str | None:
+        try:
+            return (self.path / name).read_text()
+        except OSError:
+            return None
+
+    def usage(self) -> dict:
+        """
+        Usage of whole job's process tree (only values that are available)
+        """
+        result = {}
+        stat = self._read("cpu.stat")
+        if stat is not None:
+            values = dict(line.split() for line in stat.splitlines() if line.strip())
+            if "user_usec" in values and "system_usec" in values:
+                result["user_time"] = int(values["user_usec"]) / 1e6
+                result["sys_time"] = int(values["system_usec"]) / 1e6
+        peak = self._read("memory.peak")
+        if peak is not None:
+            result["max_rss"] = int(peak)
+        return result
+
+    def remove(self, timeout: float = 5.0) -> None:
+        """
+        Kill processes that are left in cgroup and remove it
+        """
+        if (self.path / "cgroup.kill").exists():
+            try:
+                (self.path / "cgroup.kill").write_text("1")
+            except OSError:
+                pass
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self.path.rmdir()
+                return
+            except FileNotFoundError:
+                return
+            except OSError as e:
+                if time.time() >= deadline:
+                    print(f"[INFO] Failed to remove cgroup '{self.path}': {e}")
+                    return
+                time.sleep(0.05)
+
+
+class Cgroups:
+    """
+    Delegated cgroup v2 directory, where child cgroup is created for each job with limits
+    """
+
+    # NOTE: limit -> (controller, file)
+    FILES = {
+        "cpus": ("cpuset", "cpuset.cpus"),
+        "cpu_weight": ("cpu", "cpu.weight"),
+        "cpu_max": ("cpu", "cpu.max"),
+        "memory_max": ("memory", "memory.max"),
+        "io_weight": ("io", "io.weight"),
+    }
+
+    def __init__(self, root: Path | str):
+        self.root = Path(root)
+        available = (self.root / "cgroup.controllers").read_text().split()
+        wanted = {controller for controller, _ in self.FILES.values()} & set(available)
+        if wanted:
+            (self.root / "cgroup.subtree_control").write_text(" ".join(f"+{v}" for v in sorted(wanted)))
+        self.controllers = set((self.root / "cgroup.subtree_control").read_text().split())
+
+    @staticmethod
+    def _value(name: str, value) -> str:
+        if name == "cpus":
+            return ",".join(str(v) for v in value)
+        if name == "cpu_max":
+            period = 100000
+            return f"{int(value * period)} {period}"
+        if name == "io_weight":
+            return f"default {value}"
+        return str(value)
+
+    def create(self, name: str, limits: ResourceLimits) -> JobCgroup:
+        path = self.root / name
+        path.mkdir(exist_ok=True)
+        applied = []
+        for limit, (controller, file) in self.FILES.items():
+            value = getattr(limits, limit)
+            if value is None or controller not in self.controllers:
+                continue
+            (path / file).write_text(self._value(limit, value))
+            applied.append(limit)
+        return JobCgroup(path, tuple(applied))
+
+
+_cgroups = None
+_cgroups_lock = threading.Lock()
+
+
+def get_cgroups() -> Cgroups | None:
+    """
+    Cgroups at NODE_CGROUP (once per process), None if it's not set or not usable
+    """
+    global _cgroups
+    with _cgroups_lock:
+        if _cgroups is None:
+            root = os.environ.get("NODE_CGROUP")
+            _cgroups = False
+            if root:
+                try:
+                    _cgroups = Cgroups(root)
+                except OSError as e:
+                    print(f"[INFO] cgroup '{root}' is not usable, limits are applied without it: {e}")
+        return _cgroups or None
@@ -4,12 +4,19 @@ import asyncio.subprocess
 import functools
 import time
 import datetime
-from threading import Lock
+import mmap
+import struct
+from array import array
+from bisect import bisect_right
+from threading import Lock, Event
 from pathlib import Path
 from base64 import b64decode
 from helpers import *
 import yaml
-import shutil
+from uploads import upload_engine, ContentStore, BundleWriter
+import warm_pool
+import accounting
+from limits import ResourceLimits, get_cgroups
 
 
 # https://stackoverflow.com/questions/1191374/using-module-subprocess-with-timeout/4825933#4825933
@@ -52,7 +59,10 @@ class StreamDispatcher(asyncio.subprocess.SubprocessStreamProtocol):
         """Called when the child process writes data into its stdout
         or stderr pipe.
         """
-        super().pipe_data_received(fd, data)
+        if self._targets is None or fd not in self._targets:
+            # NOTE: protocol's own readers are not consumed by anyone, so feed them only for pipes
+            # without dedicated target (otherwise reading is paused as soon as reader's buffer is full)
+            super().pipe_data_received(fd, data)
         if self._targets is not None:
             if fd in self._targets:
                 target = self._targets[fd]
@@ -101,6 +111,8 @@ class StreamReaderHighjack:
 
 class ProcessInfo(Dictable):
 
+    __slots__ = ("root", "cmd", "shell", "env", "cwd", "files", "artifacts", "logs")
+
     def __init__(
             self,
             root: Path = None,
@@ -124,6 +136,11 @@ class ProcessInfo(Dictable):
 
 class RunInfo(Dictable):
 
+    __slots__ = (
+        "_start_time", "_end_time", "_cpu_time", "_active", "_stopping", "_pid", "_retcode", "_exception", "_usage",
+        "_on_change",
+    )
+
     def __init__(
             self,
             start_time: float = None,
@@ -134,7 +151,13 @@ class RunInfo(Dictable):
             pid: int = None,
             retcode: int = None,
             exception=None,
+            usage: dict = None,
+            on_change=None,
     ):
+        # NOTE: on_change is called with name and new value of field on each change
+        # NOTE: usage is resource usage of finished process: user_time, sys_time (seconds), max_rss, max_rss_bound,
+        # read_bytes, write_bytes (bytes), see accounting. cpu_time is user_time + sys_time
+        self._on_change = on_change
         self._start_time = start_time
         self._end_time = end_time
         self._cpu_time = cpu_time
@@ -143,6 +166,11 @@ class RunInfo(Dictable):
         self._pid = pid
         self._retcode = retcode
         self._exception = exception
+        self._usage = usage
+
+    def _changed(self, name, value):
+        if self._on_change is not None:
+            self._on_change(name, value)
 
     @property
     def start_time(self):
@@ -153,6 +181,7 @@ class RunInfo(Dictable):
         if self._start_time is not None:
             raise ValueError("Overriding start_time is not allowed!")
         self._start_time = value
+        self._changed("start_time", value)
 
     @property
     def end_time(self):
@@ -163,6 +192,7 @@ class RunInfo(Dictable):
         if self._end_time is not None:
             raise ValueError("Overriding end_time is not allowed!")
         self._end_time = value
+        self._changed("end_time", value)
 
     @property
     def cpu_time(self):
@@ -173,6 +203,7 @@ class RunInfo(Dictable):
         if self._cpu_time is not None:
             raise ValueError("Overriding cpu_time is not allowed!")
         self._cpu_time = value
+        self._changed("cpu_time", value)
 
     @property
     def active(self):
@@ -186,7 +217,10 @@ class RunInfo(Dictable):
             print(f"[INFO] Process with pid {self.pid} become active")
         if self._active != False and value is False:
             print(f"[INFO] Process with pid {self.pid} become inactive")
+        changed = self._active != value
         self._active = value
+        if changed:
+            self._changed("active", value)
 
     @property
     def stopping(self):
@@ -198,7 +232,10 @@ class RunInfo(Dictable):
             print(f"[INFO] Stop of process with pid {self.pid} is started")
         if self._stopping is True and value is False:
             print(f"[INFO] Stop of process with pid {self.pid} is ended")
+        changed = self._stopping != value
         self._stopping = value
+        if changed:
+            self._changed("stopping", value)
 
     @property
     def pid(self):
@@ -209,6 +246,7 @@ class RunInfo(Dictable):
         if self._pid is not None:
             raise ValueError("Overriding pid is not allowed!")
         self._pid = value
+        self._changed("pid", value)
 
     @property
     def retcode(self):
@@ -219,6 +257,7 @@ class RunInfo(Dictable):
         if self._retcode is not None:
             raise ValueError("Overriding retcode is not allowed!")
         self._retcode = value
+        self._changed("retcode", value)
 
     @property
     def exception(self):
@@ -229,10 +268,24 @@ class RunInfo(Dictable):
         if self._exception is not None:
             raise ValueError("Overriding exception is not allowed!")
         self._exception = value
+        self._changed("exception", value)
+
+    @property
+    def usage(self):
+        return self._usage
+
+    @usage.setter
+    def usage(self, value):
+        if self._usage is not None:
+            raise ValueError("Overriding usage is not allowed!")
+        self._usage = value
+        self._changed("usage", value)
 
 
 class UploadState(Dictable):
 
+    __slots__ = ("source", "target", "missing", "uploading", "progress", "size", "digest")
+
     def __init__(
             self,
             source,
@@ -245,64 +298,403 @@ class UploadState(Dictable):
         self.uploading = None
         self.progress = 0
         self.size = 0
+        self.digest = None
+
+
+class OutputCapture:
+    """
+    Captured output stream of the process.
+    Every line is written into log file, in memory there is only compact index of lines:
+    timestamps (array of doubles) and offsets of lines in log file (array of uint64).
+    When index grows above max_lines it's spilled into side file (<log>.idx).
+    Lines data are served from memory-mapped log file
+
+    In chunked mode raw chunks from the pipe are written as is (with large write buffer),
+    only time of each chunk is recorded and lines index is built lazily, when lines are requested
+    (not on close, so output that is never read by lines is never indexed)
+    """
+
+    INDEX_RECORD = struct.Struct("<dQ")
+
+    CHUNKED_BUFFER_SIZE = 2 ** 20
+
+    def __init__(self, path: Path, max_lines: int = None, chunked: bool = False):
+        self.path = path
+        self.index_path = path.with_name(path.name + ".idx")
+        self._max_lines = max_lines
+        self._file = None
+        self._index_file = None
+        self._times = array("d")
+        self._offsets = array("Q")
+        self._first = 0
+        self._count = 0
+        self._size = 0
+        self._indexed = 0
+        self._map = None
+        self._index_map = None
+        self._waiter = None
+        self.finished = False
+        self.chunked = chunked
+        self._chunk_times = array("d")
+        self._chunk_offsets = array("Q")
+        self._eof = None
+
+    @classmethod
+    def from_file(cls, path: Path, max_lines: int = None):
+        """
+        Finished capture over existing log file (i.e. of job, whose runner is gone).
+        Lines are indexed lazily, as in chunked mode, their times are unknown (NaN)
+        """
+        capture = cls(path, max_lines, chunked=True)
+        capture._size = os.path.getsize(path)
+        capture._chunk_times.append(float("nan"))
+        capture._chunk_offsets.append(0)
+        capture.finished = True
+        return capture
+
+    def __len__(self):
+        if self.chunked:
+            self._index_chunks()
+        return self._count
+
+    def open(self):
+        if self.chunked:
+            self._file = open(self.path, "wb", buffering=self.CHUNKED_BUFFER_SIZE)
+            self._eof = asyncio.get_running_loop().create_future()
+        else:
+            self._file = open(self.path, "wb")
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        for f in (self._file, self._index_file, self._map, self._index_map):
+            if f is not None:
+                f.close()
+        self._file = None
+        self._index_file = None
+        self._map = None
+        self._index_map = None
+        self.finished = True
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None:
+            if not self._waiter.done():
+                self._waiter.set_result(None)
+            self._waiter = None
+
+    async def wait_for(self, count: int, timeout: float = None):
+        """
+        Wait until there is more than count lines or stream is finished (or timeout expired)
+        """
+        if len(self) > count or self.finished:
+            return
+        if self._waiter is None:
+            self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._waiter), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def append(self, timestamp: float, line: bytes):
+        if self._file is not None:
+            self._file.write(line)
+        self._size += len(line)
+        self._add_line(timestamp, self._size - len(line), self._size)
+        if self._waiter is not None:
+            self._wake()
+
+    def _add_line(self, timestamp: float, offset: int, end: int):
+        self._times.append(timestamp)
+        self._offsets.append(offset)
+        self._indexed = end
+        self._count += 1
+        if self._max_lines is not None and len(self._times) > self._max_lines:
+            self._spill_index()
+
+    def feed_data(self, data: bytes):
+        """
+        Chunked mode: called by StreamDispatcher with raw data from the pipe
+        """
+        self._file.write(data)
+        self._chunk_times.append(time.time())
+        self._chunk_offsets.append(self._size)
+        self._size += len(data)
+        if self._waiter is not None:
+            self._wake()
+
+    def feed_eof(self):
+        if self._eof is not None and not self._eof.done():
+            self._eof.set_result(None)
+
+    def set_exception(self, exc):
+        # NOTE: exception is handled by process close monitor
+        self.feed_eof()
+
+    async def wait_eof(self):
+        if self._eof is not None:
+            await self._eof
+
+    def _index_chunks(self):
+        # NOTE: unfinished last line is indexed only when stream is finished
+        if self._indexed >= self._size:
+            return
+        self._map = self._remap(self._map, self.path, self._file, self._size)
+        chunk = bisect_right(self._chunk_offsets, self._indexed) - 1
+        start = self._indexed
+        while start < self._size:
+            end = self._map.find(b"\n", start, self._size)
+            if end < 0:
+                if not self.finished:
+                    break
+                end = self._size
+            else:
+                end += 1
+            while chunk + 1 < len(self._chunk_offsets) and self._chunk_offsets[chunk + 1] <= start:
+                chunk += 1
+            self._add_line(self._chunk_times[chunk], start, end)
+            start = end
+        if self.finished and self._index_file is not None:
+            # NOTE: index is complete, spilled part is only read from now on
+            self._index_file.close()
+            self._index_file = None
+
+    def _spill_index(self):
+        if self._index_file is None:
+            # NOTE: in chunked mode index may be continued after capture is closed
+            self._index_file = open(self.index_path, "ab" if self._first else "wb")
+        records = bytearray(self.INDEX_RECORD.size * len(self._times))
+        for i, v in enumerate(zip(self._times, self._offsets)):
+            self.INDEX_RECORD.pack_into(records, i * self.INDEX_RECORD.size, *v)
+        self._index_file.write(records)
+        self._first = self._count
+        self._times = array("d")
+        self._offsets = array("Q")
+
+    @staticmethod
+    def _remap(current, path: Path, file, size: int):
+        if file is not None:
+            file.flush()
+        if current is not None:
+            if len(current) >= size:
+                return current
+            current.close()
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _record(self, i: int) -> tuple[float, int]:
+        if i >= self._first:
+            return self._times[i - self._first], self._offsets[i - self._first]
+        return self.INDEX_RECORD.unpack_from(self._index_map, i * self.INDEX_RECORD.size)
+
+    def lines(self, start=None, end=None) -> list:
+        """
+        Lines in range [start:end] (same semantic as for list slicing) as tuples (time, line data).
+        Line data are memoryviews into single copy of requested page
+        """
+        indexes = range(len(self))[start:end]
+        if len(indexes) == 0 or indexes.step != 1:
+            return []
+        if indexes.start < self._first:
+            self._index_map = self._remap(
+                self._index_map, self.index_path, self._index_file, self._first * self.INDEX_RECORD.size
+            )
+        records = [self._record(i) for i in indexes]
+        page_end = self._record(indexes.stop)[1] if indexes.stop < self._count else self._indexed
+        page_start = records[0][1]
+        if page_end > page_start:
+            self._map = self._remap(self._map, self.path, self._file, page_end)
+            page = memoryview(self._map[page_start:page_end])
+        else:
+            page = memoryview(b"")
+        result = []
+        for k, (timestamp, offset) in enumerate(records):
+            next_offset = records[k + 1][1] if k + 1 < len(records) else page_end
+            result.append((timestamp, page[offset - page_start:next_offset - page_start]))
+        return result
 
 
 class NodeRunner:
 
-    def __init__(self, root, max_runtime: float = None, terminate_timeout: float = 30.0, encoding=None):
+    # NOTE: files that process only appends to, so upload/sync copies only their new tail
+    APPEND_ONLY = (".stdout", ".stderr")
+
+    def __init__(
+            self,
+            root,
+            max_runtime: float = None,
+            terminate_timeout: float = 30.0,
+            encoding=None,
+            on_exit=None,
+            log_lines: int = 10000,
+            capture: str = "lines",
+            on_event=None,
+            warm: bool = False,
+            warm_preload: list = None,
+            sample_interval: float = None,
+            max_samples: int = 512,
+            limits: dict = None,
+    ):
         # Provide necessary base for multi-threaded run
         # (noderunner runs subprocess in separate thread)
+        # NOTE: on_exit is called once, when process becomes inactive or failed to start
+        # NOTE: log_lines limits number of lines index entries kept in memory for each of stdout/stderr
+        # NOTE: capture is "lines" (read output line by line) or "chunks" (write raw chunks, index lines lazily)
+        # NOTE: on_event is called with event name and dict of event's data on state changes:
+        # started, stopping, exited, error, upload (single file is uploaded), uploaded (upload is finished)
+        # NOTE: warm is for python scripts (cmd is [<python>, <script>, *args]) - script is run in process forked
+        # from pre-started interpreter with warm_preload modules imported (see warm_pool)
+        # NOTE: sample_interval enables sampling of cpu time and rss of running process (at most max_samples
+        # are kept, see accounting.UsageSeries), final usage is reported in run_info anyway
+        # NOTE: limits are resource limits of the process (cpus, cpu_weight, cpu_max, memory_max, io_weight),
+        # see limits module
+        if capture not in ("lines", "chunks"):
+            raise ValueError(f"Unknown capture mode '{capture}'!")
         self._max_runtime = max_runtime
         self._terminate_timeout = terminate_timeout or 30.0
         self._encoding = encoding
         self._process_info = ProcessInfo(Path(root).absolute().resolve(), None, None, None, None, None, None, None)
-        self._run_info = RunInfo(None, None, None, None)
+        self._on_event = on_event
+        self._warm = warm
+        self._warm_preload = tuple(warm_preload or ())
+        self._run_info = RunInfo(None, None, None, None, on_change=self._on_run_info)
         self._subprocess = None
+        self._series = accounting.UsageSeries(sample_interval, max_samples) if sample_interval else None
+        self._limits = ResourceLimits.from_config(limits)
+        self._cgroup = None
 
         self._stdout_coroutine = None
         self._stderr_coroutine = None
         self._uploader_coroutine = None
         self._supervisor_coroutine = None
+        self._sampler_coroutine = None
+        self._sync_coroutine = None
+        self._sync_state = {}
+        self._sync_error = None
 
         self._stdin = []
-        self._stdout = []
-        self._stderr = []
-        self._stdout_file = None
-        self._stderr_file = None
+        self._stdout = OutputCapture(self._process_info.root / ".stdout", log_lines, capture == "chunks")
+        self._stderr = OutputCapture(self._process_info.root / ".stderr", log_lines, capture == "chunks")
 
         self._upload_state = {}
         self._uploaders = []
+        self._upload_cancel = Event()
+        self._sync_cancel = Event()
         self._thread_lock = Lock()
         self._wait_lock = Lock()
         self._waiting = False
+        self._inactive = None
+        self._finished = None
+        self._on_exit = on_exit
 
     @staticmethod
-    async def _stream_capture(reader, target, target_file):
+    async def _stream_capture(reader, target):
         async for line in reader:
-            if target is not None:
-                target.append((time.time(), line))
-            if target_file is not None:
-                target_file.write(line)
+            target.append(time.time(), line)
+
+    def _emit(self, event: str, **data):
+        if self._on_event is not None:
+            self._on_event(event, data)
+
+    def _on_run_info(self, name, value):
+        if name == "active" and value is True:
+            self._emit("started", pid=self._run_info.pid)
+        elif name == "stopping" and value is True:
+            self._emit("stopping")
+        elif name == "retcode":
+            self._emit("exited", retcode=value, cpu_time=self._run_info.cpu_time)
+        elif name == "exception":
+            self._emit("error", exception=str(value))
+
+    def _notify_exit(self):
+        if self._inactive is not None and not self._inactive.done():
+            self._inactive.set_result(None)
+        on_exit, self._on_exit = self._on_exit, None
+        if on_exit is not None:
+            on_exit()
 
     def _on_proc_closing(self):
         if self._run_info.end_time is None:
             self._run_info.end_time = time.time()
         self._run_info.active = False
+        self._notify_exit()
 
     def _on_proc_exception(self, exc):
         if self._run_info.end_time is None:
             self._run_info.end_time = time.time()
         self._run_info.active = False
         self._run_info.exception = exc
+        self._notify_exit()
+
+    async def _wait_inactive(self, timeout: float = None) -> bool:
+        """
+        Wait until process becomes inactive, returns False on timeout
+        """
+        try:
+            await asyncio.wait_for(asyncio.shield(self._inactive), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
 
     async def _supervise(self):
+        # NOTE: timeout is scheduled on event loop (call_at based) instead of polling
         if self._max_runtime is not None:
-            while self._run_info.active is True:
-                await asyncio.sleep(1.)
-                if time.time() - self._run_info.start_time > self._max_runtime:
-                    await self.ensure_stopped()
+            remaining = self._run_info.start_time + self._max_runtime - time.time()
+            if not await self._wait_inactive(max(remaining, 0)):
+                await self.ensure_stopped()
         await self.wait()
 
+    async def _sample(self):
+        # NOTE: /proc files are small and in memory, so they're read right on event loop
+        pid = self._run_info.pid
+        while self._run_info.active is True:
+            sample = accounting.read_proc(pid)
+            if sample is None:
+                break
+            self._series.add(time.time(), sample)
+            if await self._wait_inactive(self._series.interval):
+                break
+
+    def _final_usage(self) -> dict | None:
+        result = getattr(self._subprocess, "usage", None)
+        if result is None and accounting.child_watcher is not None:
+            result = accounting.child_watcher.pop_usage(self._subprocess.pid)
+        if result is None and self._series is not None and self._series.last is not None:
+            # NOTE: process is reaped without rusage, last sample is the best estimate
+            last = self._series.last
+            result = {"user_time": last["user_time"], "sys_time": last["sys_time"], "max_rss_bound": None,
+                      "read_bytes": last["read_bytes"], "write_bytes": last["write_bytes"]}
+        if self._cgroup is not None:
+            # NOTE: cgroup accounts whole process tree, including processes that were not waited for,
+            # and it's there even if process is reaped without rusage
+            result = {**(result or {}), **self._cgroup.usage()} or None
+        if result is not None and "max_rss" not in result:
+            result["max_rss"] = None if self._series is None else self._series.peak_rss
+        return result
+
+    async def _create_cgroup(self):
+        cgroups = get_cgroups()
+        if self._limits is None or cgroups is None:
+            return
+        try:
+            self._cgroup = await asyncio.get_running_loop().run_in_executor(
+                None, cgroups.create, f"job-{self._process_info.root.name}", self._limits
+            )
+        except OSError as e:
+            print(f"[INFO] Failed to create cgroup for process, limits are applied without it: {e}")
+
+    async def _remove_cgroup(self):
+        cgroup, self._cgroup = self._cgroup, None
+        if cgroup is not None:
+            await asyncio.get_running_loop().run_in_executor(None, cgroup.remove)
+
+    def _use_warm_pool(self) -> bool:
+        cmd = self._process_info.cmd
+        return self._warm and not self._process_info.shell and warm_pool.available() \
+            and len(cmd) > 1 and not str(cmd[1]).startswith("-")
+
     async def _subprocess_run(self):
         # Starts subprocess
         # NOTE: that section should be overriden depending on usage
@@ -313,8 +705,12 @@ class NodeRunner:
         # TODO: get_event_loop deprecated? use get_running_loop?
         # https://stackoverflow.com/questions/44630676/how-can-i-call-an-async-function-without-await
 
-        stdout_reader = asyncio.StreamReader(loop=loop)
-        stderr_reader = asyncio.StreamReader(loop=loop)
+        if self._stdout.chunked:
+            stdout_reader = self._stdout
+            stderr_reader = self._stderr
+        else:
+            stdout_reader = asyncio.StreamReader(loop=loop)
+            stderr_reader = asyncio.StreamReader(loop=loop)
 
         close_monitor = StreamReaderHighjack(
             on_eof=self._on_proc_closing,
@@ -332,26 +728,54 @@ class NodeRunner:
             loop=loop,
         )
 
-        self._stdout_file = open(self._process_info.root / ".stdout", "wb")
-        self._stderr_file = open(self._process_info.root / ".stderr", "wb")
-
-        self._stdout_coroutine = loop.create_task(self._stream_capture(stdout_reader, self._stdout, self._stdout_file))
-        self._stderr_coroutine = loop.create_task(self._stream_capture(stderr_reader, self._stderr, self._stderr_file))
-
-        transport, protocol = await loop.subprocess_exec(
-            protocol_factory,
-            *self._process_info.cmd,
-            shell=self._process_info.shell,
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            cwd=self._process_info.cwd,
-            env=self._process_info.env,
-        )
-        self._subprocess = asyncio.subprocess.Process(transport, protocol, loop)
+        self._inactive = loop.create_future()
+        self._finished = loop.create_future()
+
+        self._stdout.open()
+        self._stderr.open()
+
+        if self._stdout.chunked:
+            self._stdout_coroutine = loop.create_task(self._stdout.wait_eof())
+            self._stderr_coroutine = loop.create_task(self._stderr.wait_eof())
+        else:
+            self._stdout_coroutine = loop.create_task(self._stream_capture(stdout_reader, self._stdout))
+            self._stderr_coroutine = loop.create_task(self._stream_capture(stderr_reader, self._stderr))
+
+        await self._create_cgroup()
+        cgroup_procs, applied = (self._cgroup.procs, self._cgroup.applied) if self._cgroup else (None, ())
+
+        if self._use_warm_pool():
+            self._subprocess = await warm_pool.get_warm_pool(self._warm_preload).spawn(
+                protocol_factory,
+                self._process_info.cmd[1:],
+                cwd=self._process_info.cwd,
+                env=self._process_info.env,
+                limits=self._limits.to_dict() if self._limits else None,
+                cgroup_procs=cgroup_procs,
+                applied=applied,
+            )
+        else:
+            # NOTE: subprocesses are reaped with wait4, so their rusage is known on exit
+            accounting.install_child_watcher()
+            transport, protocol = await loop.subprocess_exec(
+                protocol_factory,
+                *self._process_info.cmd,
+                shell=self._process_info.shell,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=self._process_info.cwd,
+                env=self._process_info.env,
+                # NOTE: limits are applied in child before exec (it's forked then, not vfork'ed, so it's
+                # only for jobs with limits)
+                preexec_fn=functools.partial(self._limits.apply, cgroup_procs, applied) if self._limits else None,
+            )
+            self._subprocess = asyncio.subprocess.Process(transport, protocol, loop)
         self._run_info.pid = self._subprocess.pid
         self._run_info.active = True
         self._supervisor_coroutine = loop.create_task(self._supervise())
+        if self._series is not None:
+            self._sampler_coroutine = loop.create_task(self._sample())
 
     async def run(
             self,
@@ -362,9 +786,12 @@ class NodeRunner:
             files: dict,
             artifacts: list,
             logs: list,  # NOTE: use logs to gather extra artifacts on exit
+            blobs: dict = None,
+            blob_store: str = None,
     ) -> tuple[bool, dict]:
         """
         Run process
+        blobs are files from content-addressed store at blob_store (path -> digest), they're copied into root
         :rtype: object
         """
         if self._run_info.active is not None:
@@ -380,16 +807,16 @@ class NodeRunner:
 
         # Populate files
         files_abs = []
-        for k, v in files.items():
-            k_abs = (self._process_info.root / str(k)).resolve()
-            if k_abs.is_relative_to(self._process_info.root) is False:
-                raise ValueError(f"file '{k}' points outside root, which is not allowed!")
-            k_abs.parent.mkdir(parents=True, exist_ok=True)
-            if isinstance(v, str):
-                v = b64decode(v)
-            with open(k_abs, "wb") as f:
-                f.write(v)
-            files_abs.append(k_abs)
+        populate = []
+        for is_blob, items in ((False, files), (True, blobs or {})):
+            for k, v in items.items():
+                k_abs = (self._process_info.root / str(k)).resolve()
+                if k_abs.is_relative_to(self._process_info.root) is False:
+                    raise ValueError(f"file '{k}' points outside root, which is not allowed!")
+                files_abs.append(k_abs)
+                populate.append((k_abs, v, is_blob))
+        store = ContentStore(Path(blob_store), upload_engine) if blobs else None
+        await upload_engine.run(self._populate_files, populate, store)
 
         # Update artifacts location
         artifacts_abs = []
@@ -436,9 +863,36 @@ class NodeRunner:
             self._run_info.active = False
             self._run_info.stopping = False
             self._run_info.exception = e
+            # NOTE: readers of process that is not started never get EOF
+            for coroutine in (self._stdout_coroutine, self._stderr_coroutine):
+                if coroutine is not None:
+                    coroutine.cancel()
+            self._stdout.close()
+            self._stderr.close()
+            await self._remove_cgroup()
+            self._notify_exit()
             return fail(f"Failed to start process due to exception: {e}")
         return success()
 
+    @staticmethod
+    def _populate_files(populate: list, store: ContentStore):
+        """
+        Write files and copy blobs into root (runs on upload workers pool)
+        """
+        # NOTE: job's inputs are writable, so blobs are reflinked/copied (not hardlinked) and existing file is
+        # unlinked before it's rewritten - it may be a hardlink of seed's blob, so it's not changed in place
+        for k_abs, v, is_blob in populate:
+            k_abs.parent.mkdir(parents=True, exist_ok=True)
+            if is_blob:
+                store.clone_sync(v, k_abs)
+                continue
+            if isinstance(v, str):
+                v = b64decode(v)
+            if k_abs.exists() or k_abs.is_symlink():
+                k_abs.unlink()
+            with open(k_abs, "wb") as f:
+                f.write(v)
+
     async def stop(self) -> tuple[bool, dict]:
         """
         Initiate process termination
@@ -470,33 +924,35 @@ class NodeRunner:
         """
         if self._subprocess is None:
             raise ValueError("Process is not started!")
-        if self._run_info.active is False:
-            return success()
         do_wait = False
         with self._wait_lock:
             if not self._waiting:
                 self._waiting = True
                 do_wait = True
         if do_wait:
-            if self._run_info.retcode is None:
-                retcode, _, _ = await asyncio.gather(
-                    self._subprocess.wait(),
-                    self._stdout_coroutine,
-                    self._stderr_coroutine,
-                )
-                self._run_info.retcode = retcode
-                do_wait = False
-
-                if self._stdout_file is not None:
-                    self._stdout_file.close()
-                    self._stdout_file = None
-
-                if self._stderr_file is not None:
-                    self._stderr_file.close()
-                    self._stderr_file = None
+            try:
+                if self._run_info.retcode is None:
+                    retcode, _, _ = await asyncio.gather(
+                        self._subprocess.wait(),
+                        self._stdout_coroutine,
+                        self._stderr_coroutine,
+                    )
+                    usage = self._final_usage()
+                    if usage is not None:
+                        self._run_info.usage = usage
+                        if "user_time" in usage and "sys_time" in usage:
+                            self._run_info.cpu_time = usage["user_time"] + usage["sys_time"]
+                    await self._remove_cgroup()
+                    self._run_info.retcode = retcode
+                    do_wait = False
+
+                    self._stdout.close()
+                    self._stderr.close()
+            finally:
+                if not self._finished.done():
+                    self._finished.set_result(None)
         else:
-            while self._run_info.active is True:
-                await asyncio.sleep(1.)
+            await asyncio.shield(self._finished)
         return success(retcode=self._run_info.retcode)
 
     async def ensure_stopped(self) -> tuple[bool, dict]:
@@ -509,10 +965,7 @@ class NodeRunner:
                 if self._run_info.active is True:
                     if self._run_info.stopping is None:
                         await self.stop()
-                    wait_until = time.time() + self._terminate_timeout
-                    while self._run_info.active and time.time() < wait_until:
-                        await asyncio.sleep(.1)
-                    if self._run_info.active:
+                    if not await self._wait_inactive(self._terminate_timeout):
                         await self.kill()
                 await self.wait()
         return success()
@@ -527,8 +980,14 @@ class NodeRunner:
                 if cancel_upload:
                     await self.cancel_upload()
                 await self._uploader_coroutine
+        if self._sync_coroutine is not None:
+            # NOTE: sync is cancelled if it's stopped and it's failure is in sync state, neither is an error of exit
+            # (awaited with wait, so cancellation of exit itself is not suppressed)
+            await asyncio.wait([self._sync_coroutine])
         if self._supervisor_coroutine is not None:
             await self._supervisor_coroutine
+        if self._sampler_coroutine is not None:
+            await self._sampler_coroutine
         return success()
 
     async def put(self, data) -> tuple[bool, dict]:
@@ -561,18 +1020,28 @@ class NodeRunner:
             stderr: bool = True,
             logs: bool = True,
             artifacts: bool = True,
+            store: str = None,
+            bundle: str = None,
     ) -> tuple[bool, dict]:
         """
         Initiate artifcats etc. upload process
         Don't start if it is already uploading
+
+        If store is specified then files are put into content-addressed store at that path
+        and destination gets links to store's blobs plus manifest (.manifest.yaml)
+
+        If bundle is specified ("gzip" or "zstd") then all files are written as single
+        compressed tar archive (bundle.tar.gz/bundle.tar.zst) with index of members
         """
         if self._uploader_coroutine is not None:
             raise ValueError("Uploading were started already!")
+        if store is not None and bundle is not None:
+            raise ValueError("Upload into store and as bundle at the same time is not supported!")
         files = []
         if stats:
             data = to_dict(
-                process_info=self._process_info.to_dict(),
-                run_info=self._run_info.to_dict(),
+                process_info=self._process_info.to_dict(conv_to_str=True),
+                run_info=self._run_info.to_dict(conv_to_str=True),
             )
             stats_file_path = self._process_info.root / ".stats.yaml"
             with open(stats_file_path, "w") as f:
@@ -596,7 +1065,13 @@ class NodeRunner:
         # TODO: get_event_loop deprecated? use get_running_loop?
         # https://stackoverflow.com/questions/44630676/how-can-i-call-an-async-function-without-await
 
-        self._uploader_coroutine = loop.create_task(self._upload(self._process_info.root, files, Path(path)))
+        if store is not None:
+            store = ContentStore(Path(store), upload_engine)
+        if bundle is not None:
+            bundle = BundleWriter(Path(path) / f"bundle.tar.{BundleWriter.EXTENSIONS.get(bundle)}", bundle)
+        self._uploader_coroutine = loop.create_task(
+            self._upload(self._process_info.root, files, Path(path), store, bundle)
+        )
         return success()
 
     def _is_uploading(self):
@@ -608,13 +1083,14 @@ class NodeRunner:
         Check if is uploading
         Result is in 'value' field
         """
-        return success(self._is_uploading())
+        return success(value=self._is_uploading())
 
-    async def cancel_upload(self, msg: str) -> bool:
+    async def cancel_upload(self, msg: str = None) -> bool:
         """
-        Cancel uppload
+        Cancel uppload (in-flight copies are stopped after current chunk)
         """
         if self._is_uploading():
+            self._upload_cancel.set()
             result = self._uploader_coroutine.cancel(msg)
             if result:
                 return success()
@@ -622,21 +1098,33 @@ class NodeRunner:
                 return fail("Failed to cancel upload for some reason")
         return success()
 
-    async def _upload(self, src_root: Path, files: list[Path], destination: Path):
+    async def _upload(
+            self,
+            src_root: Path,
+            files: list[Path],
+            destination: Path,
+            store: ContentStore = None,
+            bundle: BundleWriter = None,
+    ):
         """
         Copy/upload specified files from source to destination
         """
         for fp in files:
-            rel_path = fp.relative_to(src_root)
+            rel_path = str(fp.relative_to(src_root))
             if rel_path not in self._upload_state:
-                rel_path = str(rel_path)
                 missing = not fp.exists()
                 if not missing:
-                    size = os.path.getsize(destination / rel_path)
+                    size = os.path.getsize(fp)
                 else:
                     size = 0
-                self._upload_state[rel_path] = UploadState(fp, destination / rel_path, missing)
+                target = destination / rel_path if bundle is None else bundle.path
+                self._upload_state[rel_path] = UploadState(fp, target, missing)
                 self._upload_state[rel_path].size = size
+        if bundle is not None:
+            await upload_engine.run(self._upload_bundle, bundle)
+            self._emit("uploaded", destination=str(bundle.path))
+            return
+        uploads = []
         for k, v in self._upload_state.items():
             skip = True
             if v.missing:
@@ -646,17 +1134,156 @@ class NodeRunner:
                     v.uploading = True
                     skip = False
             if not skip:
-                # TODO: replace with something wrapped, not raw copy
-                shutil.copy2(v.source, v.target)
+                uploads.append(self._upload_file(k, v, store))
+        await asyncio.gather(*uploads)
+        if store is not None:
+            manifest = {
+                k: to_dict(digest=v.digest, size=v.size)
+                for k, v in self._upload_state.items() if v.digest is not None
+            }
+            destination.mkdir(parents=True, exist_ok=True)
+            with open(destination / ".manifest.yaml", "w") as f:
+                yaml.safe_dump(to_dict(store=str(store.root), files=manifest), f)
+        self._emit("uploaded", destination=str(destination))
+
+    def _upload_bundle(self, bundle: BundleWriter):
+        """
+        Write all files into bundle (runs on upload workers pool)
+        """
+        bundle.open()
+        for k, v in self._upload_state.items():
+            if v.missing or v.uploading is not None:
+                continue
+            v.uploading = True
+
+            def on_progress(n, state=v):
+                state.progress += n
+
+            try:
+                bundle.add(v.source, k, on_progress, self._upload_cancel)
+            finally:
                 v.uploading = False
-                v.progress = v.size
+            self._emit("upload", file=k, progress=v.progress, size=v.size)
+        bundle.close()
+
+    async def _upload_file(self, rel_path: str, state: UploadState, store: ContentStore = None):
+        """
+        Copy single file on upload workers pool, progress is updated by chunks
+        """
+        def on_progress(n):
+            state.progress += n
+
+        try:
+            if store is None:
+                # NOTE: files that are up to date (i.e. after live sync) are not copied again
+                await upload_engine.run(
+                    upload_engine.update_sync,
+                    state.source,
+                    state.target,
+                    state.source.name in self.APPEND_ONLY,
+                    on_progress,
+                    self._upload_cancel,
+                )
+                state.progress = state.size
+            else:
+                state.digest, _ = await upload_engine.run(
+                    store.put_sync, state.source, on_progress, self._upload_cancel
+                )
+                await upload_engine.run(store.link_sync, state.digest, state.target)
+        finally:
+            state.uploading = False
+        self._emit("upload", file=rel_path, progress=state.progress, size=state.size)
+
+    async def start_sync(
+            self,
+            path: str,
+            interval: float = 5.0,
+            stdout: bool = True,
+            stderr: bool = True,
+            logs: bool = True,
+            artifacts: bool = True,
+    ) -> tuple[bool, dict]:
+        """
+        Start live sync of logs and artifacts into path while process is running
+        Each pass copies only new tail of stdout/stderr and changed files,
+        last pass is made right after process end.
+        Sync into same path resumes from what's already there
+        """
+        if self._subprocess is None:
+            raise ValueError("Syncing but subprocess is not launched!")
+        if self._sync_coroutine is not None:
+            raise ValueError("Sync were started already!")
+        files = []
+        if stdout:
+            files.append(self._process_info.root / ".stdout")
+        if stderr:
+            files.append(self._process_info.root / ".stderr")
+        if logs:
+            files += self._process_info.logs
+        if artifacts:
+            files += self._process_info.artifacts
+        loop = asyncio.get_running_loop()
+        self._sync_coroutine = loop.create_task(self._sync(self._process_info.root, files, Path(path), interval))
+        return success()
+
+    async def stop_sync(self) -> tuple[bool, dict]:
+        """
+        Stop live sync
+        """
+        if self._sync_coroutine is not None and not self._sync_coroutine.done():
+            self._sync_cancel.set()
+            self._sync_coroutine.cancel()
+        return success()
 
-    async def upload_state(self, ):
+    async def _sync(self, src_root: Path, files: list[Path], destination: Path, interval: float):
+        try:
+            while True:
+                last = self._finished.done()
+                self._stdout.flush()
+                self._stderr.flush()
+                await asyncio.gather(*[self._sync_file(fp, src_root, destination) for fp in files])
+                if last:
+                    break
+                if self._run_info.active is True:
+                    await self._wait_inactive(interval)
+                else:
+                    # NOTE: make last pass when output is completely captured
+                    await asyncio.shield(self._finished)
+        except Exception as e:
+            # NOTE: failed sync is not a failure of the job, sync is just stopped
+            print(f"[INFO] Live sync into '{destination}' is failed: {e}")
+            self._sync_error = str(e)
+
+    async def _sync_file(self, fp: Path, src_root: Path, destination: Path):
+        if not fp.exists():
+            return
+        rel_path = str(fp.relative_to(src_root))
+        await upload_engine.run(
+            upload_engine.update_sync,
+            fp,
+            destination / rel_path,
+            fp.name in self.APPEND_ONLY,
+            None,
+            self._sync_cancel,
+        )
+        self._sync_state[rel_path] = os.path.getsize(destination / rel_path)
+
+    async def sync_state(self, ):
+        """
+        Current live sync state: size of each synced file at destination and error if sync is failed
+        """
+        return success(
+            syncing=self._sync_coroutine is not None and not self._sync_coroutine.done(),
+            sync_state=dict(self._sync_state),
+            sync_error=self._sync_error,
+        )
+
+    async def upload_state(self, conv_to_str: bool = False):
         """
         Current uppload state
         """
         return success(
-            upload_state={k: v.to_dict() for k, v in self._upload_state.items()}
+            upload_state={k: v.to_dict(conv_to_str=conv_to_str) for k, v in self._upload_state.items()}
         )
 
     async def process_info(self, conv_to_str: bool):
@@ -671,10 +1298,19 @@ class NodeRunner:
         """
         return success(run_info=self._run_info.to_dict(conv_to_str=conv_to_str))
 
+    async def usage(self):
+        """
+        Resource usage of process (final or current one while it's running) and sampled series
+        """
+        current = self._run_info.usage
+        if current is None and self._run_info.active is True:
+            current = accounting.read_proc(self._run_info.pid)
+        return success(usage=current, samples=None if self._series is None else self._series.to_dict())
+
     @staticmethod
     def _log(log_lines, start, end, time_format, encoding):
         result = []
-        for v in log_lines[start:end]:
+        for v in log_lines.lines(start, end):
             v0 = v[0]
             v1 = v[1]
             if time_format is not None:
@@ -683,7 +1319,9 @@ class NodeRunner:
                 else:
                     v0 = datetime.datetime.fromtimestamp(v0).strftime(time_format)
             if encoding is not None and encoding is not False:
-                v1 = v1.decode(encoding)
+                v1 = str(v1, encoding)
+            else:
+                v1 = bytes(v1)
             result.append((v0, v1))
         return result
 
@@ -728,3 +1366,36 @@ class NodeRunner:
         Othrewise lines data are raw bytes
         """
         return success(stderr=self._log(self._stderr, start, end, time_format, encoding or self._encoding))
+
+    async def follow(
+            self,
+            stream: str = "stdout",
+            start: int = 0,
+            limit: int = 1000,
+            timeout: float = 15.0,
+            time_format="",
+            encoding=None
+    ):
+        """
+        Wait for lines of process' STDOUT/STDERR starting from line with index start
+        and return them as soon as they are captured (up to limit lines)
+        Negative start counts lines from the end (i.e. -10 for last 10 lines)
+
+        Result contains
+        - lines - same items as for stdout/stderr
+        - next - index of line to continue from
+        - finished - True if stream is ended and all lines were returned
+        """
+        if stream not in ("stdout", "stderr"):
+            raise ValueError(f"Unknown stream '{stream}'!")
+        capture = self._stdout if stream == "stdout" else self._stderr
+        if start < 0:
+            start = max(len(capture) + start, 0)
+        await capture.wait_for(start, timeout)
+        lines = self._log(capture, start, start + limit, time_format, encoding or self._encoding)
+        next_line = start + len(lines)
+        return success(
+            lines=lines,
+            next=next_line,
+            finished=capture.finished and next_line >= len(capture),
+        )
@@ -0,0 +1,217 @@
+import asyncio
+import functools
+import itertools
+import multiprocessing
+import threading
+from concurrent.futures import Future
+from job_engine import JobEngine
+from node_runner_general import NodeRunner
+
+
+# NOTE: sharded mode moves NodeRunner instances into a fixed pool of worker processes.
+# Each worker hosts it's runners on own JobEngine loop, so stdout/stderr capture
+# and supervision are spread across cores. Front end keeps only RemoteRunner proxies
+# and routes every call to the shard by token
+
+
+# NOTE: NodeRunner's callbacks, that are forwarded from shard to front end
+EVENTS = ("on_exit", "on_event")
+
+
+def _shard_main(conn) -> None:
+    engine = JobEngine(name="shard-engine")
+    runners = {}
+    send_lock = threading.Lock()
+
+    def reply(msg) -> None:
+        with send_lock:
+            conn.send(msg)
+
+    def forward(token, name, *args) -> None:
+        reply((None, token, name, args))
+
+    async def handle(req_id, token, method, args, kwargs) -> None:
+        try:
+            if method == "__create__":
+                for name in kwargs.pop("events", ()):
+                    kwargs[name] = functools.partial(forward, token, name)
+                runners[token] = NodeRunner(*args, **kwargs)
+                result = None
+            elif method == "__drop__":
+                runners.pop(token, None)
+                result = None
+            else:
+                result = await getattr(runners[token], method)(*args, **kwargs)
+            msg = (req_id, True, result)
+        except BaseException as e:
+            msg = (req_id, False, e)
+        try:
+            reply(msg)
+        except Exception as e:
+            reply((req_id, False, RuntimeError(f"Failed to send result of '{method}': {e}")))
+
+    engine.start()
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError, KeyboardInterrupt):
+            break
+        if msg is None:
+            break
+        engine.submit(handle(*msg))
+    engine.shutdown(wait=False)
+
+
+class ShardClient:
+    """
+    Front end side of single shard worker process
+    """
+
+    def __init__(self, index: int, ctx):
+        self.index = index
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(target=_shard_main, args=(child_conn,), name=f"node-shard-{index}", daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._listeners = {}
+        self._ids = itertools.count()
+        self._reader = threading.Thread(target=self._read, name=f"node-shard-{index}-reader", daemon=True)
+        self._reader.start()
+
+    def _read(self) -> None:
+        while True:
+            try:
+                msg = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            if msg[0] is None:
+                # NOTE: events from runners are sent as (None, token, callback name, args)
+                listener = self._listeners.get(msg[1:3])
+                if listener is not None:
+                    listener(*msg[3])
+                continue
+            req_id, ok, result = msg
+            future = self._pending.pop(req_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+        for future in list(self._pending.values()):
+            future.set_exception(BrokenPipeError(f"Shard {self.index} is gone!"))
+        self._pending.clear()
+
+    def send(self, token: int, method: str, *args, **kwargs) -> Future:
+        future = Future()
+        req_id = next(self._ids)
+        self._pending[req_id] = future
+        with self._send_lock:
+            self._conn.send((req_id, token, method, args, kwargs))
+        return future
+
+    def listen(self, token: int, name: str, callback) -> None:
+        self._listeners[(token, name)] = callback
+
+    def forget(self, token: int) -> None:
+        for key in [k for k in self._listeners if k[0] == token]:
+            del self._listeners[key]
+
+    async def call(self, token: int, method: str, *args, **kwargs):
+        return await asyncio.wrap_future(self.send(token, method, *args, **kwargs))
+
+    def close(self, timeout: float = None) -> None:
+        try:
+            with self._send_lock:
+                self._conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._conn.close()
+
+
+class RemoteRunner:
+    """
+    Proxy for NodeRunner that lives in shard worker process.
+    Exposes same async methods as NodeRunner
+    """
+
+    def __init__(self, shard: ShardClient, token: int):
+        self._shard = shard
+        self._token = token
+
+    @property
+    def shard(self) -> int:
+        return self._shard.index
+
+    def __getattr__(self, name):
+        if name[:1] == "_":
+            raise AttributeError(name)
+
+        async def method(*args, **kwargs):
+            return await self._shard.call(self._token, name, *args, **kwargs)
+
+        method.__name__ = name
+        return method
+
+    def release(self) -> None:
+        """
+        Drop runner in shard worker (runner should be finished already)
+        """
+        self._shard.forget(self._token)
+        self._shard.send(self._token, "__drop__")
+
+
+class ShardPool:
+    """
+    Fixed pool of shard worker processes, jobs are routed to shards by token
+    """
+
+    def __init__(self, count: int):
+        if count < 1:
+            raise ValueError("Shards count should be positive!")
+        self._count = count
+        self._shards = []
+        self._lock = threading.Lock()
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def start(self) -> None:
+        with self._lock:
+            if self._shards:
+                return
+            ctx = multiprocessing.get_context("spawn")
+            self._shards = [ShardClient(i, ctx) for i in range(self._count)]
+
+    def shard_for(self, token: int) -> ShardClient:
+        self.start()
+        return self._shards[token % self._count]
+
+    def runner(self, token: int, *args, **kwargs) -> RemoteRunner:
+        """
+        Create NodeRunner in shard for the token and return proxy for it.
+        Callbacks (on_exit, on_event) are called in front end when shard reports them
+        """
+        shard = self.shard_for(token)
+        events = []
+        for name in EVENTS:
+            callback = kwargs.pop(name, None)
+            if callback is not None:
+                shard.listen(token, name, callback)
+                events.append(name)
+        if events:
+            kwargs["events"] = tuple(events)
+        shard.send(token, "__create__", *args, **kwargs)
+        return RemoteRunner(shard, token)
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        with self._lock:
+            for shard in self._shards:
+                shard.close(timeout)
+            self._shards = []
@@ -34,12 +34,28 @@ def dict_to_list(d: dict, l: list, active: bool) -> list:
     return list_for_df
 
 
+def get_nodes() -> tuple[dict, list]:
+    # NOTE: only jobs changed since last seen version (ETag) are requested
+    cache = st.session_state.setdefault("nodes", {"etag": None, "dict": {}, "list": []})
+    params = {}
+    headers = {}
+    if cache["etag"] is not None:
+        params["since"] = cache["etag"].strip('"')
+        headers["If-None-Match"] = cache["etag"]
+    response = requests.get("http://127.0.0.1:8000/get", params=params, headers=headers)
+    if response.status_code != 304:
+        changed, list_nodes = response.json()
+        dict_nodes = {k: v for k, v in cache["dict"].items() if int(k) in list_nodes}
+        dict_nodes.update(changed)
+        cache.update(etag=response.headers.get("ETag"), dict=dict_nodes, list=list_nodes)
+    return cache["dict"], cache["list"]
+
+
 def start_list_page() -> None:
     st.title("Список процессов")
 
     try:
-        response = requests.get("http://127.0.0.1:8000/get")
-        dict_nodes, list_nodes = response.json()
+        dict_nodes, list_nodes = get_nodes()
 
         if dict_nodes == {}:
             st.write("Нет запущенных процессов")
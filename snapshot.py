@@ -0,0 +1,65 @@
+import threading
+
+
+class StateSnapshot:
+    """
+    Versioned snapshot of jobs summaries.
+    Version is bumped only when summary of some job is really changed (or job is dropped),
+    so readers can check version (ETag) or fetch only jobs changed since known version
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._jobs = {}
+        self._changed = {}
+        self._order = []
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def update(self, token: int, summary: dict, first: bool = False) -> int:
+        """
+        Set summary of the job (new jobs are added in front, or to the end if first is False)
+        """
+        with self._lock:
+            if self._jobs.get(token) == summary:
+                return self._version
+            if token not in self._jobs:
+                if first:
+                    self._order.insert(0, token)
+                else:
+                    self._order.append(token)
+            self._version += 1
+            self._jobs[token] = summary
+            # NOTE: re-insert, so changes are ordered by version
+            self._changed.pop(token, None)
+            self._changed[token] = self._version
+            return self._version
+
+    def remove(self, token: int) -> int:
+        with self._lock:
+            if token not in self._jobs:
+                return self._version
+            self._version += 1
+            del self._jobs[token]
+            del self._changed[token]
+            self._order.remove(token)
+            return self._version
+
+    def get(self, since: int = None) -> tuple[int, dict, list]:
+        """
+        Returns version, summaries of jobs (only changed after since version if it's specified) and order of all jobs.
+        Jobs that are not in order are dropped
+        """
+        with self._lock:
+            if since is None or since > self._version:
+                jobs = dict(self._jobs)
+            else:
+                jobs = {}
+                for k, v in reversed(self._changed.items()):
+                    if v <= since:
+                        break
+                    jobs[k] = self._jobs[k]
+            return self._version, jobs, list(self._order)
@@ -1,7 +1,13 @@
+import os
 import datetime
+import threading
+from bisect import bisect_right
 import yaml
 
 
+DAY_SECONDS = 24 * 3600
+
+
 def get_data_for_web() -> list:
     with open("files_yaml/setting_time.yaml", "r") as file:
         data = yaml.safe_load(file)
@@ -58,49 +64,77 @@ def load_data_from_web(index: int, key: str, value: int | str) -> None:
         with open("files_yaml/setting_time.yaml", "w") as file:
             yaml.safe_dump(data, file)
 
+        quota_table.invalidate()
 
-def get_settings(day: int) -> dict:
-    with open("files_yaml/setting_time.yaml", "r") as file:
-        text = yaml.safe_load(file)
 
-    start_params = text[day]["start_time"]
-    end_params = text[day]["end_time"]
-    end_params_yesterday = text[day - 1 if day > 0 else 6]["end_time"]
+def time_to_seconds(value: str) -> int:
+    hours, minutes = str(value).split(":")[:2]
+    return int(hours) * 3600 + int(minutes) * 60
 
-    start_time = start_params["value"].split(":")
-    end_time = end_params["value"].split(":")
 
-    start_value = 0
-    end_value = 0
+class QuotaTable:
+    """
+    Weekly schedule compiled into sorted intervals over seconds of week.
+    Rebuilt only after invalidate() or when settings file is changed by another process
+    """
 
-    for i in range(2):
-        if start_time[i][0] == "0":
-            start_value += int(start_time[i][1]) * (60 ** (2 - i))
-        else:
-            start_value += int(start_time[i]) * (60 ** (2 - i))
+    def __init__(self, path: str):
+        self._path = path
+        self._mtime = None
+        # NOTE: (starts, params) are published as one tuple, so lookup never sees them from different builds
+        self._table = ([], [])
+        self._lock = threading.Lock()
 
-        if end_time[i][0] == "0":
-            end_value += int(end_time[i][1]) * (60 ** (2 - i))
-        else:
-            end_value += int(end_time[i]) * (60 ** (2 - i))
+    def invalidate(self) -> None:
+        self._mtime = None
+
+    def _build(self, data: dict) -> None:
+        starts = []
+        params = []
+
+        def add(start: int, end: int, value: dict) -> None:
+            if start < end:
+                starts.append(start)
+                params.append(value)
+
+        for day in range(7):
+            base = day * DAY_SECONDS
+            start_params = data[day]["start_time"]
+            end_params = data[day]["end_time"]
+            end_params_yesterday = data[day - 1 if day > 0 else 6]["end_time"]
+            start_value = time_to_seconds(start_params["value"])
+            end_value = time_to_seconds(end_params["value"])
+
+            # NOTE: [start, end) - start params, [end, midnight) - end params, before that - yesterday's end params
+            first = min(start_value, end_value)
+            add(base, base + first, end_params_yesterday)
+            add(base + start_value, base + end_value, start_params)
+            add(base + end_value, base + DAY_SECONDS, end_params)
+
+        self._table = (starts, params)
+
+    def _refresh(self) -> None:
+        mtime = os.stat(self._path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            with open(self._path, "r") as file:
+                data = yaml.safe_load(file)
+            self._build(data)
+            self._mtime = mtime
+
+    def lookup(self, week_seconds: int) -> dict:
+        self._refresh()
+        starts, params = self._table
+        return params[bisect_right(starts, week_seconds) - 1]
 
-    start_params["value"] = start_value
-    end_params["value"] = end_value
 
-    return {"start_params": start_params,
-            "end_params": end_params,
-            "end_params_yesterday": end_params_yesterday}
+quota_table = QuotaTable("files_yaml/setting_time.yaml")
 
 
 def get_counts() -> dict:
     cur_time = datetime.datetime.today()
-    day = cur_time.weekday()
-    cur_time_seconds = cur_time.hour * 3600 + cur_time.minute * 60 + cur_time.second
-
-    settings = get_settings(day)
-    if settings["start_params"]["value"] <= cur_time_seconds < settings["end_params"]["value"]:
-        return settings["start_params"]
-    elif cur_time_seconds >= settings["end_params"]["value"]:
-        return settings["end_params"]
-    elif settings["start_params"]["value"] > cur_time_seconds:
-        return settings["end_params_yesterday"]
+    week_seconds = cur_time.weekday() * DAY_SECONDS + cur_time.hour * 3600 + cur_time.minute * 60 + cur_time.second
+    return dict(quota_table.lookup(week_seconds))
@@ -0,0 +1,405 @@
+import os
+import errno
+import shutil
+import hashlib
+import tempfile
+import tarfile
+import zlib
+import yaml
+import asyncio
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from helpers import to_dict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+_FALLBACK_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EBADF, errno.ENOTSUP)
+
+
+class UploadCancelled(Exception):
+    pass
+
+
+class UploadEngine:
+    """
+    Copies files on bounded pool of worker threads, chunk by chunk,
+    so event loop is never blocked by upload and progress is known after each chunk.
+    Uses copy_file_range/sendfile where available, falls back to plain read/write
+    """
+
+    def __init__(self, workers: int = 4, chunk_size: int = 2 ** 23):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload")
+        self._chunk_size = chunk_size
+
+    def _chunks(self, src, dst):
+        src_fd = src.fileno()
+        dst_fd = dst.fileno()
+        for name in ("copy_file_range", "sendfile"):
+            func = getattr(os, name, None)
+            if func is None:
+                continue
+            first = True
+            while True:
+                try:
+                    if name == "copy_file_range":
+                        n = func(src_fd, dst_fd, self._chunk_size)
+                    else:
+                        n = func(dst_fd, src_fd, None, self._chunk_size)
+                except OSError as e:
+                    if first and e.errno in _FALLBACK_ERRORS:
+                        break
+                    raise
+                first = False
+                if n == 0:
+                    return
+                yield n
+        buffer = bytearray(self._chunk_size)
+        view = memoryview(buffer)
+        while True:
+            n = src.readinto(buffer)
+            if not n:
+                return
+            dst.write(view[:n])
+            yield n
+
+    def copy_sync(self, source: Path, target: Path, on_progress=None, cancel: threading.Event = None) -> int:
+        """
+        Copy file from source to target (in caller's thread)
+        on_progress is called with number of bytes copied by each chunk
+        Raises UploadCancelled if cancel event is set
+        """
+        target.parent.mkdir(parents=True, exist_ok=True)
+        copied = 0
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            for n in self._chunks(src, dst):
+                copied += n
+                if on_progress is not None:
+                    on_progress(n)
+                if cancel is not None and cancel.is_set():
+                    raise UploadCancelled(f"Upload of '{source}' is cancelled")
+        shutil.copystat(source, target)
+        return copied
+
+    @staticmethod
+    def _same_tail(source: Path, target: Path, size: int, sample: int = 4096) -> bool:
+        start = max(size - sample, 0)
+        with open(source, "rb") as src, open(target, "rb") as dst:
+            src.seek(start)
+            dst.seek(start)
+            return src.read(size - start) == dst.read(size - start)
+
+    def update_sync(
+            self,
+            source: Path,
+            target: Path,
+            append: bool = False,
+            on_progress=None,
+            cancel: threading.Event = None,
+    ) -> int:
+        """
+        Bring target up to date with source, copying only what is changed:
+        - nothing if size and mtime are the same
+        - only new tail if append is True (source only grows) and target is prefix of source
+        - whole file otherwise
+        Target gets mtime of source as it was before copy, so changes made during copy are caught next time
+        Returns number of copied bytes
+        """
+        src_st = os.stat(source)
+        try:
+            dst_st = os.stat(target)
+        except FileNotFoundError:
+            dst_st = None
+        if dst_st is not None and dst_st.st_size == src_st.st_size and dst_st.st_mtime_ns == src_st.st_mtime_ns:
+            return 0
+        if append and dst_st is not None and 0 < dst_st.st_size <= src_st.st_size \
+                and self._same_tail(source, target, dst_st.st_size):
+            copied = 0
+            with open(source, "rb") as src, open(target, "r+b") as dst:
+                src.seek(dst_st.st_size)
+                dst.seek(dst_st.st_size)
+                dst.truncate()
+                for n in self._chunks(src, dst):
+                    copied += n
+                    if on_progress is not None:
+                        on_progress(n)
+                    if cancel is not None and cancel.is_set():
+                        raise UploadCancelled(f"Upload of '{source}' is cancelled")
+        else:
+            copied = self.copy_sync(source, target, on_progress, cancel)
+        os.utime(target, ns=(src_st.st_atime_ns, src_st.st_mtime_ns))
+        return copied
+
+    def read_sync(self, source: Path, write, on_progress=None, cancel: threading.Event = None) -> int:
+        """
+        Read file by chunks, each chunk is passed to write (buffer is reused, so chunk is valid only during call)
+        Returns number of read bytes
+        """
+        size = 0
+        buffer = bytearray(self._chunk_size)
+        view = memoryview(buffer)
+        with open(source, "rb") as src:
+            while True:
+                n = src.readinto(buffer)
+                if not n:
+                    break
+                write(view[:n])
+                size += n
+                if on_progress is not None:
+                    on_progress(n)
+                if cancel is not None and cancel.is_set():
+                    raise UploadCancelled(f"Upload of '{source}' is cancelled")
+        return size
+
+    async def run(self, func, *args):
+        """
+        Run blocking upload function on workers pool
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def copy(self, source: Path, target: Path, on_progress=None, cancel: threading.Event = None) -> int:
+        return await self.run(self.copy_sync, source, target, on_progress, cancel)
+
+
+class ContentStore:
+    """
+    Content-addressed store for uploads: one read-only blob per sha256 digest (<root>/objects/ab/cdef...).
+    Read-only views (upload destinations, seed files in job roots) are materialized by hardlinks (reflinks
+    or copies if hardlink is not possible), writable ones (job's input files) - by reflinks or copies,
+    so job can't change shared blob
+    """
+
+    FICLONE = 0x40049409
+
+    def __init__(self, root: Path, engine: UploadEngine):
+        self.root = Path(root)
+        self._engine = engine
+
+    def blob_path(self, digest: str) -> Path:
+        return self.root / "objects" / digest[:2] / digest[2:]
+
+    def put_sync(self, source: Path, on_progress=None, cancel: threading.Event = None) -> tuple[str, int]:
+        """
+        Put file into store, file is read once: it's hashed while it's written into temporary file,
+        which becomes blob (or is dropped if there is blob with same digest already)
+        Returns digest and size of the file
+        """
+        writer = self.new_blob()
+        try:
+            self._engine.read_sync(source, writer.write, on_progress, cancel)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.commit()
+
+    def has(self, digest: str) -> bool:
+        return len(digest) == 64 and all(c in "0123456789abcdef" for c in digest) and self.blob_path(digest).exists()
+
+    def new_blob(self) -> "BlobWriter":
+        """
+        Writer to put blob into store by chunks (i.e. while it's received), digest is computed on the fly
+        """
+        return BlobWriter(self)
+
+    def _reflink(self, blob: Path, target: Path) -> bool:
+        try:
+            import fcntl
+        except ImportError:
+            return False
+        with open(blob, "rb") as src, open(target, "wb") as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), self.FICLONE, src.fileno())
+            except OSError:
+                return False
+        return True
+
+    def _prepare_target(self, target: Path) -> None:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if target.exists() or target.is_symlink():
+            target.unlink()
+
+    def link_sync(self, digest: str, target: Path) -> None:
+        """
+        Materialize blob as read-only target file (hardlink to the blob)
+        """
+        blob = self.blob_path(digest)
+        self._prepare_target(target)
+        try:
+            os.link(blob, target)
+            return
+        except OSError:
+            pass
+        if not self._reflink(blob, target):
+            self._engine.copy_sync(blob, target)
+
+    def clone_sync(self, digest: str, target: Path) -> None:
+        """
+        Materialize blob as writable target file (reflink, or copy if reflink is not supported)
+        """
+        blob = self.blob_path(digest)
+        self._prepare_target(target)
+        if not self._reflink(blob, target):
+            self._engine.copy_sync(blob, target)
+        os.chmod(target, 0o644)
+
+
+class BlobWriter:
+    """
+    Writes data into temporary file in store, on commit it becomes blob (or is dropped if blob exists already)
+    """
+
+    def __init__(self, store: ContentStore):
+        self._store = store
+        self._digest = hashlib.sha256()
+        self.size = 0
+        tmp_dir = store.root / "objects"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, prefix=".tmp-")
+        self._file = os.fdopen(fd, "wb")
+        self._tmp_path = Path(tmp_path)
+
+    def write(self, data) -> None:
+        self._digest.update(data)
+        self._file.write(data)
+        self.size += len(data)
+
+    def commit(self, expected: str = None) -> tuple[str, int]:
+        """
+        Finish blob, returns digest and size. Raises ValueError if digest is not as expected
+        """
+        self._file.close()
+        digest = self._digest.hexdigest()
+        try:
+            if expected is not None and expected != digest:
+                raise ValueError(f"Digest mismatch: expected '{expected}', got '{digest}'!")
+            blob = self._store.blob_path(digest)
+            if not blob.exists():
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                os.chmod(self._tmp_path, 0o444)
+                os.replace(self._tmp_path, blob)
+        finally:
+            if self._tmp_path.exists():
+                self._tmp_path.unlink()
+        return digest, self.size
+
+    def abort(self) -> None:
+        self._file.close()
+        if self._tmp_path.exists():
+            self._tmp_path.unlink()
+
+
+class BundleWriter:
+    """
+    Writes files as single tar archive, compressed on the fly (gzip or zstd) without staging copy.
+    Archive is compressed by independent frames (gzip members / zstd frames), cut at member boundaries
+    after frame_size of uncompressed data, so it's still regular .tar.gz/.tar.zst.
+    Index (<bundle>.index.yaml) keeps frame's offset in archive and member data offset in frame,
+    so single member can be fetched by decompressing only it's frame (see read_bundle_member)
+    """
+
+    EXTENSIONS = {"gzip": "gz", "zstd": "zst"}
+
+    def __init__(self, path: Path, compression: str = "gzip", frame_size: int = 2 ** 20, chunk_size: int = 2 ** 20):
+        if compression not in self.EXTENSIONS:
+            raise ValueError(f"Unknown compression '{compression}'!")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd compression requires 'zstandard' package!")
+        self.path = Path(path)
+        self.index_path = self.path.with_name(self.path.name + ".index.yaml")
+        self._compression = compression
+        self._frame_size = frame_size
+        self._chunk_size = chunk_size
+        self._file = None
+        self._compressor = None
+        self._frame_start = 0
+        self._frame_raw = 0
+        self._index = {}
+
+    def open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "wb")
+
+    def _new_compressor(self):
+        if self._compression == "zstd":
+            return zstandard.ZstdCompressor().compressobj()
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def _write(self, data):
+        if self._compressor is None:
+            self._compressor = self._new_compressor()
+            self._frame_start = self._file.tell()
+            self._frame_raw = 0
+        self._file.write(self._compressor.compress(data))
+        self._frame_raw += len(data)
+
+    def _end_frame(self):
+        if self._compressor is not None:
+            self._file.write(self._compressor.flush())
+            self._compressor = None
+
+    def add(self, source: Path, arcname: str, on_progress=None, cancel: threading.Event = None) -> None:
+        st = os.stat(source)
+        info = tarfile.TarInfo(arcname)
+        info.size = st.st_size
+        info.mtime = st.st_mtime
+        info.mode = st.st_mode & 0o7777
+        self._write(info.tobuf(format=tarfile.PAX_FORMAT))
+        self._index[arcname] = to_dict(frame=self._frame_start, offset=self._frame_raw, size=info.size)
+        size = 0
+        with open(source, "rb") as src:
+            while size < info.size:
+                data = src.read(min(self._chunk_size, info.size - size))
+                if not data:
+                    raise ValueError(f"File '{source}' is truncated while bundling!")
+                self._write(data)
+                size += len(data)
+                if on_progress is not None:
+                    on_progress(len(data))
+                if cancel is not None and cancel.is_set():
+                    raise UploadCancelled(f"Upload of '{source}' is cancelled")
+        if size % tarfile.BLOCKSIZE:
+            self._write(tarfile.NUL * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE))
+        if self._frame_raw >= self._frame_size:
+            self._end_frame()
+
+    def close(self) -> dict:
+        self._write(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+        self._end_frame()
+        self._file.close()
+        self._file = None
+        with open(self.index_path, "w") as f:
+            yaml.safe_dump(to_dict(compression=self._compression, members=self._index), f)
+        return self._index
+
+
+def read_bundle_member(path: Path, name: str, chunk_size: int = 2 ** 20) -> bytes:
+    """
+    Fetch single member of bundle, written by BundleWriter, using it's index
+    """
+    path = Path(path)
+    with open(path.with_name(path.name + ".index.yaml"), "r") as f:
+        index = yaml.safe_load(f)
+    member = index["members"][name]
+    if index["compression"] == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires 'zstandard' package!")
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    else:
+        decompressor = zlib.decompressobj(31)
+    end = member["offset"] + member["size"]
+    result = bytearray()
+    with open(path, "rb") as f:
+        f.seek(member["frame"])
+        while len(result) < end:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            result += decompressor.decompress(data)
+    return bytes(result[member["offset"]:end])
+
+
+upload_engine = UploadEngine()
@@ -0,0 +1,359 @@
+import os
+import sys
+import json
+import atexit
+import signal
+import socket
+import asyncio
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from accounting import from_rusage
+from limits import ResourceLimits
+
+
+# NOTE: warm mode for python tasks. Instead of starting fresh interpreter for each job,
+# script is run in process, forked from pre-started interpreter ("zygote") with common modules
+# already imported. Job's stdin/stdout/stderr are pipes, created by NodeRunner and passed
+# to zygote over unix socket (SCM_RIGHTS), so output is captured as usual.
+# Zygote reports pid of forked process and later it's exit status with resource usage (wait4 rusage)
+
+
+_HEADER = 4
+
+
+def available() -> bool:
+    return hasattr(os, "fork") and hasattr(socket, "send_fds") and hasattr(socket, "AF_UNIX")
+
+
+def _exit_code(code) -> int:
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def _child(request: dict, fds: list) -> None:
+    code = 1
+    try:
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+        os.closerange(3, os.sysconf("SC_OPEN_MAX") if hasattr(os, "sysconf") else 1024)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        if request.get("limits"):
+            ResourceLimits(**request["limits"]).apply(request.get("cgroup_procs"), tuple(request.get("applied", ())))
+        os.chdir(request["cwd"])
+        if request["env"] is not None:
+            os.environ.clear()
+            os.environ.update(request["env"])
+        if os.environ.get("PYTHONUNBUFFERED"):
+            sys.stdout.reconfigure(write_through=True)
+            sys.stderr.reconfigure(write_through=True)
+        script = os.path.abspath(request["argv"][0])
+        sys.argv = list(request["argv"])
+        sys.path[0] = os.path.dirname(script)
+        import runpy
+        try:
+            runpy.run_path(script, run_name="__main__")
+            code = 0
+        except SystemExit as e:
+            code = _exit_code(e.code)
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            code = 1
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+    finally:
+        try:
+            # NOTE: same as interpreter's exit: wait for non-daemon threads, then run atexit handlers
+            threading._shutdown()
+            atexit._run_exitfuncs()
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _recv_request(conn: socket.socket) -> tuple[dict, list]:
+    data, fds, _, _ = socket.recv_fds(conn, 2 ** 16, 3)
+    size = int.from_bytes(data[:_HEADER], "little")
+    data = data[_HEADER:]
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return json.loads(data), fds
+
+
+def _send(conn: socket.socket, **kwargs) -> None:
+    try:
+        conn.sendall(json.dumps(kwargs).encode() + b"\n")
+    except OSError:
+        pass
+
+
+def serve(path: str, preload: list) -> None:
+    """
+    Zygote main loop: preload modules, then fork process for each request
+    """
+    import importlib
+    import selectors
+    # NOTE: Ctrl+C is for server process, not for zygote
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for name in preload:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            print(f"[INFO] Failed to preload module '{name}': {e}", file=sys.stderr)
+
+    parent = os.getppid()
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(64)
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ)
+    pidfd_open = getattr(os, "pidfd_open", None)
+    children = {}
+
+    def reap(pid: int, status: int, ru) -> None:
+        conn = children.pop(pid, None)
+        if conn is not None:
+            _send(conn, returncode=os.waitstatus_to_exitcode(status), usage=from_rusage(ru))
+            conn.close()
+
+    print("ready", flush=True)
+    while os.getppid() == parent:
+        for key, _ in selector.select(timeout=1.0 if pidfd_open is not None else 0.05):
+            if key.fileobj is listener:
+                conn, _ = listener.accept()
+                fds = []
+                try:
+                    request, fds = _recv_request(conn)
+                    if not os.path.isdir(request["cwd"]):
+                        raise FileNotFoundError(f"No such directory: '{request['cwd']}'")
+                    if not os.path.isfile(os.path.join(request["cwd"], request["argv"][0])):
+                        raise FileNotFoundError(f"No such file: '{request['argv'][0]}'")
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    pid = os.fork()
+                    if pid == 0:
+                        _child(request, fds)
+                except Exception as e:
+                    _send(conn, error=str(e))
+                    conn.close()
+                    continue
+                finally:
+                    for fd in fds:
+                        os.close(fd)
+                children[pid] = conn
+                _send(conn, pid=pid)
+                if pidfd_open is not None:
+                    selector.register(pidfd_open(pid), selectors.EVENT_READ, pid)
+            else:
+                selector.unregister(key.fileobj)
+                os.close(key.fileobj)
+                _, status, ru = os.wait4(key.data, 0)
+                reap(key.data, status, ru)
+        if pidfd_open is None:
+            while children:
+                pid, status, ru = os.wait4(-1, os.WNOHANG)
+                if pid == 0:
+                    break
+                reap(pid, status, ru)
+
+
+class _PipeProtocol(asyncio.Protocol):
+    """
+    Feeds data of single pipe into subprocess protocol, as if it's subprocess transport's pipe
+    """
+
+    def __init__(self, protocol, fd: int):
+        self._protocol = protocol
+        self._fd = fd
+
+    def data_received(self, data):
+        self._protocol.pipe_data_received(self._fd, data)
+
+    def connection_lost(self, exc):
+        self._protocol.pipe_connection_lost(self._fd, exc)
+
+
+class _PipeWriter:
+
+    def __init__(self, transport):
+        self._transport = transport
+
+    def write(self, data):
+        self._transport.write(data)
+
+    def write_eof(self):
+        self._transport.close()
+
+
+class WarmProcess:
+    """
+    Process, forked by zygote. Exposes same parts as asyncio.subprocess.Process, that are used by NodeRunner
+    """
+
+    def __init__(self, pid: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, stdin):
+        self.pid = pid
+        self.stdin = stdin
+        self.returncode = None
+        self.usage = None
+        self._reader = reader
+        self._writer = writer
+        self._waiter = asyncio.get_running_loop().create_task(self._wait_status())
+
+    async def _wait_status(self) -> int:
+        try:
+            line = await self._reader.readline()
+        finally:
+            self._writer.close()
+        if line:
+            reply = json.loads(line)
+            self.returncode = reply["returncode"]
+            self.usage = reply.get("usage")
+        else:
+            # NOTE: zygote is gone, exit status is unknown
+            self.returncode = -signal.SIGKILL
+        return self.returncode
+
+    async def wait(self) -> int:
+        return await asyncio.shield(self._waiter)
+
+    def send_signal(self, sig) -> None:
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self) -> None:
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        self.send_signal(signal.SIGKILL)
+
+
+class WarmPool:
+    """
+    Pre-started interpreter with preloaded modules, that forks processes for python scripts on demand
+    """
+
+    def __init__(self, preload: tuple = ()):
+        self._preload = tuple(preload)
+        self._lock = threading.Lock()
+        self._process = None
+        self._dir = None
+        self._path = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                return
+            self._dir = tempfile.mkdtemp(prefix="warm-pool-")
+            self._path = str(Path(self._dir) / "zygote.sock")
+            self._process = subprocess.Popen(
+                [sys.executable, str(Path(__file__).absolute()), self._path, *self._preload],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+            )
+            if self._process.stdout.readline().strip() != b"ready":
+                raise RuntimeError("Failed to start warm pool!")
+            self._process.stdout.close()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._process is not None:
+                self._process.terminate()
+                self._process.wait()
+                self._process = None
+            if self._path is not None and os.path.exists(self._path):
+                os.unlink(self._path)
+                os.rmdir(self._dir)
+                self._path = None
+
+    def _request(self, request: dict, fds: list) -> tuple[socket.socket, int]:
+        self.start()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self._path)
+            data = json.dumps(request).encode()
+            socket.send_fds(sock, [len(data).to_bytes(_HEADER, "little") + data], fds)
+            line = b""
+            while not line.endswith(b"\n"):
+                chunk = sock.recv(1)
+                if not chunk:
+                    raise BrokenPipeError("Warm pool is gone!")
+                line += chunk
+            reply = json.loads(line)
+            if "error" in reply:
+                raise OSError(reply["error"])
+        except BaseException:
+            sock.close()
+            raise
+        return sock, reply["pid"]
+
+    async def spawn(self, protocol_factory, argv: list, cwd, env: dict = None, limits: dict = None,
+                    cgroup_procs: str = None, applied: tuple = ()) -> WarmProcess:
+        """
+        Run python script (argv[0] - path of script, relative to cwd) in forked process.
+        Output is fed into protocol from protocol_factory (as for loop.subprocess_exec)
+        limits are applied in forked process (see limits.ResourceLimits.apply)
+        """
+        loop = asyncio.get_running_loop()
+        pipes = [os.pipe() for _ in range(3)]
+        child_fds = [pipes[0][0], pipes[1][1], pipes[2][1]]
+        request = {"argv": [str(v) for v in argv], "cwd": str(cwd), "env": env, "limits": limits,
+                   "cgroup_procs": cgroup_procs, "applied": list(applied)}
+        try:
+            sock, pid = await loop.run_in_executor(None, self._request, request, child_fds)
+        except BaseException:
+            for fd in (pipes[0][1], pipes[1][0], pipes[2][0]):
+                os.close(fd)
+            raise
+        finally:
+            for fd in child_fds:
+                os.close(fd)
+        protocol = protocol_factory()
+        for fd in (1, 2):
+            await loop.connect_read_pipe(lambda fd=fd: _PipeProtocol(protocol, fd), os.fdopen(pipes[fd][0], "rb", 0))
+        stdin, _ = await loop.connect_write_pipe(asyncio.BaseProtocol, os.fdopen(pipes[0][1], "wb", 0))
+        reader, writer = await asyncio.open_unix_connection(sock=sock)
+        return WarmProcess(pid, reader, writer, _PipeWriter(stdin))
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_warm_pool(preload=()) -> WarmPool:
+    """
+    Warm pool for given set of preloaded modules (one per process)
+    """
+    key = tuple(sorted(preload or ()))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = WarmPool(key)
+        return _pools[key]
+
+
+@atexit.register
+def _shutdown_pools() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.shutdown()
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,116 @@
+import os
+import time
+import shutil
+import threading
+from pathlib import Path
+from uploads import upload_engine, ContentStore
+
+
+class Workspaces:
+    """
+    Job roots, materialized from per task type seed directories.
+    Seed's files are put into content-addressed store once (and again only when file's size or mtime is changed),
+    each job root gets read-only hardlinks of store's blobs (reflinks or copies if hardlink is not possible),
+    so job root is made in time that doesn't depend on size of the seed.
+    Job may add files to it's root and replace seed's files (i.e. write new file after unlink), but not change
+    them in place.
+    Job roots are either on disk (<logs>/<token>) or on tmpfs (<tmpfs>/<token>) for short-lived jobs
+    """
+
+    SKIP = ("__pycache__", )
+
+    # NOTE: seed is rescanned (stats only) at most once per SCAN_INTERVAL seconds
+    SCAN_INTERVAL = 2.0
+
+    def __init__(self, logs_root: Path, seeds_root: Path, tmpfs_root: Path = Path("/dev/shm/node-runner")):
+        self._logs_root = Path(logs_root)
+        self._seeds_root = Path(seeds_root)
+        self._tmpfs_root = Path(tmpfs_root)
+        self._stores = {
+            False: ContentStore(self._seeds_root / ".store", upload_engine),
+            True: ContentStore(self._tmpfs_root / ".store", upload_engine),
+        }
+        self._digests = {}
+        self._manifests = {}
+        self._lock = threading.Lock()
+
+    def tmpfs_available(self) -> bool:
+        return self._tmpfs_root.parent.is_dir()
+
+    def path_for(self, token: str, tmpfs: bool = False) -> Path:
+        """
+        Path of job root (nothing is created yet)
+        """
+        if tmpfs and self.tmpfs_available():
+            return self._tmpfs_root / token
+        return self._logs_root / token
+
+    @staticmethod
+    def _stat(path: Path) -> tuple | None:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def _scan(self, seed: str, tmpfs: bool) -> tuple[list, list]:
+        # NOTE: file is hashed again only if it's (size, mtime) is changed, since editing file in place
+        # doesn't change mtime of it's directory
+        seed_path = self._seeds_root / seed
+        if not seed_path.is_dir():
+            raise FileNotFoundError(f"No seed directory '{seed_path}'!")
+        store = self._stores[tmpfs]
+        dirs = []
+        files = []
+        for dir_path, dir_names, file_names in os.walk(seed_path):
+            dir_names[:] = [d for d in dir_names if d not in self.SKIP]
+            rel_dir = Path(dir_path).relative_to(seed_path)
+            dirs += [rel_dir / d for d in dir_names]
+            for f in file_names:
+                file_path = Path(dir_path) / f
+                file_stat = self._stat(file_path)
+                key = (file_path, tmpfs)
+                cached = self._digests.get(key)
+                blob_stat = None if cached is None else self._stat(store.blob_path(cached[1]))
+                if cached is None or cached[0] != file_stat or cached[2] != blob_stat:
+                    if cached is not None and cached[2] != blob_stat:
+                        # NOTE: blob is changed through hardlink in job root (read-only mode doesn't stop root user)
+                        store.blob_path(cached[1]).unlink(missing_ok=True)
+                    digest, _ = store.put_sync(file_path)
+                    cached = self._digests[key] = (file_stat, digest, self._stat(store.blob_path(digest)))
+                files.append((rel_dir / f, cached[1]))
+        return dirs, files
+
+    def _seed(self, seed: str, tmpfs: bool) -> tuple[list, list]:
+        with self._lock:
+            cached = self._manifests.get((seed, tmpfs))
+            if cached is not None and time.monotonic() - cached[0] < self.SCAN_INTERVAL:
+                return cached[1], cached[2]
+            dirs, files = self._scan(seed, tmpfs)
+            self._manifests[(seed, tmpfs)] = (time.monotonic(), dirs, files)
+            return dirs, files
+
+    def create(self, path: Path, seed: str = None) -> Path:
+        """
+        Create job root at path and materialize seed (name of directory in seeds root) in it
+        """
+        path.mkdir(parents=True, exist_ok=True)
+        if seed is not None:
+            tmpfs = path.is_relative_to(self._tmpfs_root)
+            dirs, files = self._seed(seed, tmpfs)
+            store = self._stores[tmpfs]
+            for d in dirs:
+                (path / d).mkdir(exist_ok=True)
+            for rel_path, digest in files:
+                store.link_sync(digest, path / rel_path)
+        return path
+
+    def release(self, path: Path | str | None) -> None:
+        """
+        Remove job root if it's on tmpfs (roots on disk are kept as logs)
+        """
+        if path is None:
+            return
+        path = Path(path)
+        if path.is_relative_to(self._tmpfs_root) and path != self._tmpfs_root and path.name != ".store":
+            shutil.rmtree(path, ignore_errors=True)